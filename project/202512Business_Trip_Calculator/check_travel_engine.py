@@ -0,0 +1,332 @@
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from travel_batch import prepare, read_trips
+from travel_engine import calculate_batch, calculate_one, calculate_rules, safe_float
+
+# 出差补贴计算的回归检查 + 随机性质检查 + 批量计算吞吐基准
+# 改动计算逻辑（尤其是为提速重写）后在本目录运行 python check_travel_engine.py，有不通过的项会以非 0 退出
+# 界面里的 calculate_logic 直接调用 calculate_one，这里检查的就是界面用的那套算法
+
+# ---------- 配置区域 ----------
+random_cases = 5000                          # 随机性质检查的行程数
+random_seed = 20260131                       # 固定种子，每次生成同一批随机行程
+bench_rows = 200000                          # 批量计算基准的行数
+bench_loop_rows = 20000                      # 逐条计算对照的行数（太慢，只取一部分再折算）
+baseline_file = ""                           # 吞吐基准线文件（如 engine_bench_baseline.json），留空则只打印不比较
+save_baseline = False                        # True 时把本次结果写进 baseline_file 作为新的基准线
+slowdown_limit = 1.5                         # 比基准线慢多少倍算不通过
+# -------------------------------
+
+BASE = {
+    "start_date": "2026-03-01", "end_date": "2026-03-31", "traffic": "180", "other": "20",
+    "house_fixed": "300", "house_invoice": "100", "cost_day": "50",
+    "special_money": "0", "special_days": "0", "house_type": 1,
+}
+MIDNIGHT = datetime(2026, 3, 10)
+AFTERNOON = datetime(2026, 3, 10, 15)
+FIELDS = ("all", "diff", "remain", "prog", "total", "total_cost_net", "cost", "rem_mon")
+
+# (说明, 配置改动, today, 期望结果)；期望值按公式手算，None 表示应判为无效
+# 未开始、特殊房补天数超过已出差天数两项记录的是现有行为（会出现负数），改动时需有意为之
+CASES = [
+    ("进行中，today 为零点", {}, MIDNIGHT,
+     dict(all=31, diff=10, remain=21, prog=1000 / 31, total=5000, total_cost_net=4500, cost=500, rem_mon=10500)),
+    ("进行中，today 带时刻：剩余天数少算当天", {}, AFTERNOON,
+     dict(all=31, diff=10, remain=20, prog=1000 / 31, total=5000, total_cost_net=4500, cost=500, rem_mon=10000)),
+    ("日期用 . 分隔", {"start_date": "2026.3.1", "end_date": "2026.3.31"}, MIDNIGHT,
+     dict(all=31, diff=10, remain=21, total=5000, rem_mon=10500)),
+    ("日期用 / 分隔", {"start_date": "2026/3/1", "end_date": "2026/03/31"}, MIDNIGHT,
+     dict(all=31, diff=10, remain=21, total=5000, rem_mon=10500)),
+    ("日期前后有空格、月日不补零", {"start_date": " 2026-3-1 ", "end_date": "2026-3-31"}, MIDNIGHT,
+     dict(all=31, diff=10, remain=21, total=5000)),
+    ("日期带时刻（Excel 日期单元格按文本读出）", {"start_date": "2026-03-01 00:00:00", "end_date": "2026/3/31 18:30"},
+     MIDNIGHT, dict(all=31, diff=10, remain=21, total=5000)),
+    ("未开始（现有行为：已出差天数为负）", {}, datetime(2026, 2, 25),
+     dict(all=31, diff=-3, remain=34, prog=-300 / 31, total=-1500, total_cost_net=-1350, cost=-150, rem_mon=17000)),
+    ("已结束", {}, datetime(2026, 4, 5),
+     dict(all=31, diff=31, remain=0, prog=100, total=15500, total_cost_net=13950, cost=1550, rem_mon=0)),
+    ("结束当天下午", {}, datetime(2026, 3, 31, 15),
+     dict(all=31, diff=31, remain=0, total=15500, rem_mon=0)),
+    ("特殊房补 4 天", {"special_days": "4", "special_money": "450"}, MIDNIGHT,
+     dict(diff=10, total=5600, total_cost_net=5100, cost=500, rem_mon=10500)),
+    ("特殊房补天数超过已出差天数（现有行为）", {"special_days": "12", "special_money": "450"}, MIDNIGHT,
+     dict(diff=10, total=6800, total_cost_net=6300, cost=500)),
+    ("特殊房补天数带小数按整数截断", {"special_days": "4.9", "special_money": "450"}, MIDNIGHT,
+     dict(total=5600)),
+    ("节支方式", {"house_type": 2}, MIDNIGHT, dict(total=3000, total_cost_net=2500, rem_mon=6300)),
+    ("房补方式为字符串", {"house_type": "2"}, MIDNIGHT, dict(total=3000)),
+    ("金额留空按 0", {"other": "", "cost_day": ""}, MIDNIGHT, dict(total=4800, cost=0, total_cost_net=4800)),
+    ("金额不是数字按 0", {"other": "二十"}, MIDNIGHT, dict(total=4800)),
+    ("单日行程", {"end_date": "2026-03-01"}, datetime(2026, 3, 1), dict(all=1, diff=1, remain=0, prog=100, total=500)),
+    ("结束早于开始", {"end_date": "2026-02-20"}, MIDNIGHT, dict(all=-8, diff=-8, remain=0, prog=0)),
+    ("月份不存在", {"start_date": "2026-13-01"}, MIDNIGHT, None),
+    ("日期格式不认识", {"start_date": "3月1日"}, MIDNIGHT, None),
+    ("日期为空", {"end_date": ""}, MIDNIGHT, None),
+    ("房补方式不是数字", {"house_type": "包干"}, MIDNIGHT, None),
+    ("特殊房补天数为 inf", {"special_days": "inf"}, MIDNIGHT, None),
+    ("缺少字段", {"traffic": KeyError}, MIDNIGHT, None),
+]
+
+
+class Checker:
+    def __init__(self):
+        self.failures = []
+        self.count = 0
+
+    def check(self, ok, message):
+        self.count += 1
+        if not ok:
+            self.failures.append(message)
+            print(f"  ✗ {message}")
+
+
+def same(a, b):
+    # 数值相等；两边都是 nan 也算相等
+    if isinstance(a, float) or isinstance(b, float):
+        return (math.isnan(a) and math.isnan(b)) or math.isclose(a, b, rel_tol=1e-12, abs_tol=1e-9)
+    return a == b
+
+
+def make_cfg(changes):
+    cfg = dict(BASE)
+    for key, value in changes.items():
+        if value is KeyError:
+            del cfg[key]
+        else:
+            cfg[key] = value
+    return cfg
+
+
+def run_cases(c):
+    print("回归用例：")
+    for title, changes, today, expected in CASES:
+        cfg = make_cfg(changes)
+        res = calculate_one(cfg, today)
+        batch = calculate_batch([cfg], today)
+        if expected is None:
+            c.check(res is None, f"{title}：应判为无效，实际得到 {res}")
+            c.check(not batch["valid"][0], f"{title}：批量计算应判为无效")
+            continue
+        if res is None:
+            c.check(False, f"{title}：不应判为无效")
+            continue
+        for key, value in expected.items():
+            c.check(same(float(res[key]), float(value)), f"{title}：{key} 期望 {value}，实际 {res[key]}")
+            c.check(same(float(batch[key][0]), float(res[key])), f"{title}：批量计算 {key} 与单条不一致")
+        # 分段费率引擎：特殊房补天数不超过已出差天数时金额应与单条计算相同
+        if 0 <= int(safe_float(cfg["special_days"])) <= res["diff"]:
+            rules = calculate_rules([cfg], today)
+            for key in ("total", "total_cost_net", "cost"):
+                c.check(same(float(rules[key][0]), float(res[key])), f"{title}：分段费率引擎 {key} 与单条不一致")
+
+    # 同一列里混着 None、nan、NaT、pd.NA 等空值：单条计算 None 按 0、nan 得 nan，批量计算归并取值时不能混为一类
+    blanks = [None, float("nan"), pd.NaT, pd.NA, ""]
+    cfgs = [dict(BASE, **{key: v}) for key in ("traffic", "house_fixed", "special_days", "house_type") for v in blanks]
+    batch = calculate_batch(cfgs, MIDNIGHT)
+    for i, cfg in enumerate(cfgs):
+        res = calculate_one(cfg, MIDNIGHT)
+        ok = (res is None) == (not batch["valid"][i])
+        if ok and res is not None:
+            ok = all(same(float(batch[k][i]), float(res[k])) for k in FIELDS)
+        c.check(ok, f"空值 {cfg}：批量计算与单条不一致")
+    print(f"  {len(CASES)} 个用例完成")
+
+
+def run_files(c):
+    # 批量工具读表：XLSX 里真正的日期单元格、CSV 文本日期，结果都应与逐条计算相同
+    print("批量工具读表：")
+    trips = [dict(BASE, name="甲"), dict(BASE, name="乙", start_date="2026-03-05", end_date="2026-04-10")]
+    expected = [calculate_one(cfg, MIDNIGHT) for cfg in trips]
+    frame = pd.DataFrame(trips).rename(columns={"start_date": "出差开始日期", "end_date": "出差结束日期"})
+    with tempfile.TemporaryDirectory() as tmp:
+        for ext in (".xlsx", ".csv"):
+            path = os.path.join(tmp, "trips" + ext)
+            df = frame.copy()
+            if ext == ".xlsx":
+                for col in ("出差开始日期", "出差结束日期"):
+                    df[col] = pd.to_datetime(df[col])
+                df.to_excel(path, index=False)
+            else:
+                df.to_csv(path, index=False, encoding="utf-8-sig")
+            chunk = prepare(next(read_trips(path, 100)))
+            batch = calculate_batch(chunk, MIDNIGHT)
+            c.check(bool(batch["valid"].all()), f"{ext}：有行程被判为无效")
+            for i, res in enumerate(expected):
+                c.check(all(same(float(batch[k].iloc[i]), float(res[k])) for k in FIELDS),
+                        f"{ext}：第 {i + 1} 行与逐条计算不一致")
+    print("  读表检查完成")
+
+
+def random_date(rng, base):
+    d = base + timedelta(days=rng.randint(-400, 400))
+    sep = rng.choice("-./")
+    pad = rng.random() < 0.5
+    return f"{d.year}{sep}{d.month:02d}{sep}{d.day:02d}" if pad else f"{d.year}{sep}{d.month}{sep}{d.day}"
+
+
+def random_money(rng):
+    r = rng.random()
+    if r < 0.05:
+        return rng.choice(["", "abc", " 12 ", "1e3", "-50"])
+    return str(rng.choice([0, 50, 100, 180, 300, 450]) if r < 0.6 else round(rng.uniform(0, 800), 2))
+
+
+def random_trips(rng, n):
+    base = datetime(2026, 1, 1)
+    trips = []
+    for _ in range(n):
+        cfg = {
+            "start_date": random_date(rng, base), "end_date": random_date(rng, base),
+            "house_type": rng.choice([1, 2, 1, "2", "x"] if rng.random() < 0.05 else [1, 2]),
+            "special_days": str(rng.choice([0, 0, 0, 1, 3, 10, 40])),
+        }
+        for key in ("traffic", "other", "house_fixed", "house_invoice", "cost_day", "special_money"):
+            cfg[key] = random_money(rng)
+        if rng.random() < 0.02:
+            cfg["start_date"] = rng.choice(["2026-02-30", "", "2026-1"])
+        trips.append(cfg)
+    return trips
+
+
+def run_properties(c):
+    print(f"随机性质检查（{random_cases} 个行程）：")
+    rng = random.Random(random_seed)
+    trips = random_trips(rng, random_cases)
+    todays = [MIDNIGHT, AFTERNOON, datetime(2025, 6, 1), datetime(2027, 6, 1, 9, 30)]
+
+    # 1. 批量计算与逐条计算完全一致
+    for today in todays:
+        batch = calculate_batch(trips, today)
+        bad = 0
+        for i, cfg in enumerate(trips):
+            res = calculate_one(cfg, today)
+            if (res is None) != (not batch["valid"][i]):
+                bad += 1
+            elif res is not None and not all(same(float(res[k]), float(batch[k][i])) for k in FIELDS):
+                bad += 1
+        c.check(bad == 0, f"today={today}：批量与逐条不一致 {bad} 条")
+
+    # 2. 日期分隔符不影响结果
+    bad = 0
+    for cfg in trips[:1000]:
+        base = calculate_one(cfg, MIDNIGHT)
+        for sep in "./":
+            other = dict(cfg, start_date=cfg["start_date"].replace("-", sep), end_date=cfg["end_date"].replace("-", sep))
+            res = calculate_one(other, MIDNIGHT)
+            if (base is None) != (res is None) or (base and not all(same(base[k], res[k]) for k in FIELDS)):
+                bad += 1
+    c.check(bad == 0, f"换日期分隔符后结果变化 {bad} 条")
+
+    # 3. 金额之间的恒等关系；进行中的行程（today 为零点）已出差 + 剩余 = 总天数
+    bad_net = bad_days = 0
+    for cfg in trips:
+        res = calculate_one(cfg, MIDNIGHT)
+        if res is None or not all(math.isfinite(res[k]) for k in ("total", "cost", "total_cost_net")):
+            continue
+        if not math.isclose(res["total"] - res["cost"], res["total_cost_net"], rel_tol=1e-9, abs_tol=1e-6):
+            bad_net += 1
+        if res["start"] <= MIDNIGHT <= res["end"] and res["diff"] + res["remain"] != res["all"]:
+            bad_days += 1
+    c.check(bad_net == 0, f"累计总补贴 - 累计支出 ≠ 净补贴 {bad_net} 条")
+    c.check(bad_days == 0, f"进行中行程 已出差+剩余 ≠ 总天数 {bad_days} 条")
+
+    # 4. 补贴为非负、无特殊房补时，累计补贴随 today 单调不减，且不超过整个行程的补贴
+    bad = 0
+    days = [MIDNIGHT + timedelta(days=d) for d in range(-500, 500, 37)]
+    for cfg in trips[:500]:
+        cfg = dict(cfg, special_days="0")
+        if any(safe_float(cfg[k]) < 0 for k in ("traffic", "other", "house_fixed", "house_invoice")):
+            continue
+        series = [calculate_one(cfg, d) for d in days]
+        if series[0] is None:
+            continue
+        totals = [r["total"] for r in series]
+        if any(b < a - 1e-9 for a, b in zip(totals, totals[1:])):
+            bad += 1
+    c.check(bad == 0, f"累计补贴随日期倒退 {bad} 条")
+
+    # 5. 分段费率引擎在没有规则、已开始的行程上与原算法一致；特殊房补换算成行程头几天的规则，
+    #    已出差天数不少于特殊天数时也应一致
+    for today in (MIDNIGHT, datetime(2027, 6, 1)):
+        batch = calculate_batch(trips, today)
+        rules = calculate_rules(trips, today)
+        special = np.array([int(safe_float(cfg["special_days"])) for cfg in trips])
+        ok = batch["valid"] & (batch["diff"] >= special) & (batch["diff"] >= 0) & (batch["all"] > 0)
+        c.check(bool((rules["valid"] == batch["valid"]).all()), f"today={today}：分段费率引擎的有效行与原算法不同")
+        c.check(bool((ok & (special > 0)).any()), f"today={today}：随机行程里没有可对照的特殊房补行程")
+        for key in ("diff", "remain", "total", "total_cost_net", "cost", "rem_mon"):
+            c.check(np.allclose(batch[key][ok], rules[key][ok], equal_nan=True),
+                    f"today={today}：分段费率引擎 {key} 与原算法不一致")
+
+    plain = [dict(cfg, special_days="0") for cfg in trips]
+
+    # 6. DataFrame 输入里只有部分行程带规则、个别费率为 nan：各行程互不影响，结果与逐个单独计算相同
+    mixed = []
+    for i, cfg in enumerate(plain[:2000]):
+        if i % 3 == 0:
+            cfg = dict(cfg, rules=[{"start": cfg["start_date"], "end": cfg["end_date"], "house": 450}])
+        elif i % 50 == 1:
+            cfg = dict(cfg, traffic="nan")
+        mixed.append(cfg)
+    together = calculate_rules(pd.DataFrame(mixed), MIDNIGHT)
+    bad = 0
+    for i, cfg in enumerate(mixed):
+        alone = calculate_rules([cfg], MIDNIGHT)
+        if together["valid"].iloc[i] != alone["valid"][0] or not all(
+                same(float(together[k].iloc[i]), float(alone[k][0])) for k in FIELDS):
+            bad += 1
+    c.check(bad == 0, f"部分带规则的 DataFrame 输入与逐个单独计算不一致 {bad} 条")
+    print("  性质检查完成")
+
+
+def run_benchmark(c):
+    print(f"批量计算基准（{bench_rows} 行）：")
+    rng = random.Random(random_seed + 1)
+    trips = random_trips(rng, bench_rows)
+    started = time.perf_counter()
+    calculate_batch(trips, MIDNIGHT)
+    batch_s = time.perf_counter() - started
+    started = time.perf_counter()
+    for cfg in trips[:bench_loop_rows]:
+        calculate_one(cfg, MIDNIGHT)
+    loop_s = (time.perf_counter() - started) * bench_rows / bench_loop_rows
+    result = {"batch_rows_per_sec": round(bench_rows / batch_s), "loop_rows_per_sec": round(bench_rows / loop_s)}
+    print(f"  批量 {result['batch_rows_per_sec']:,} 行/s | 逐条 {result['loop_rows_per_sec']:,} 行/s | "
+          f"快 {loop_s / batch_s:.1f} 倍")
+
+    if not baseline_file:
+        return
+    if save_baseline:
+        with open(baseline_file, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=4)
+        print(f"  基准线已写入：{baseline_file}")
+        return
+    if not os.path.exists(baseline_file):
+        c.check(False, f"找不到基准线 {baseline_file}，请先在同一台机器上设 save_baseline = True 生成")
+        return
+    with open(baseline_file, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    limit = baseline["batch_rows_per_sec"] / slowdown_limit
+    c.check(result["batch_rows_per_sec"] >= limit,
+            f"批量计算变慢：{result['batch_rows_per_sec']:,} 行/s，基准线 {baseline['batch_rows_per_sec']:,} 行/s")
+
+
+if __name__ == "__main__":
+    checker = Checker()
+    run_cases(checker)
+    run_files(checker)
+    run_properties(checker)
+    run_benchmark(checker)
+    if checker.failures:
+        sys.exit(f"{len(checker.failures)}/{checker.count} 项检查不通过")
+    print(f"全部 {checker.count} 项检查通过")
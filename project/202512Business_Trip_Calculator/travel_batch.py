@@ -0,0 +1,147 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import pandas as pd
+
+from travel_engine import as_datetime, calculate_batch
+
+# ========= 出差补贴批量计算（无界面）=========
+# 供月度工资批处理调用，不加载 Tk。示例：
+#   python travel_batch.py trips.xlsx -o 明细.csv -s 汇总.csv --today 2026-01-31 --group-by 员工
+# 输入支持 CSV / XLSX / JSON（JSON 可以是计算器保存的 {项目名: 配置} 文件，也可以是记录列表）
+
+# 表头别名：财务表格常用中文列名 → 计算器配置字段
+COLUMN_ALIASES = {
+    "出差开始日期": "start_date", "开始日期": "start_date",
+    "出差结束日期": "end_date", "结束日期": "end_date",
+    "交通+吃饭补贴": "traffic", "交通补贴": "traffic",
+    "其他补贴金额": "other", "其他补贴": "other",
+    "住宿包干": "house_fixed", "包干金额": "house_fixed",
+    "住宿节支": "house_invoice", "节支补贴": "house_invoice",
+    "每日支出金额": "cost_day", "每日支出": "cost_day",
+    "特殊房补金额": "special_money", "特殊房补天数": "special_days",
+    "房补方式": "house_type",
+}
+# 除起止日期外，表里没有的列按计算器新建项目的默认值补齐
+DEFAULTS = {
+    "traffic": "180", "other": "0", "house_fixed": "0", "house_invoice": "0",
+    "cost_day": "0", "special_money": "0", "special_days": "0", "house_type": 1,
+}
+RESULT_COLUMNS = ["valid", "start", "end", "all", "diff", "remain", "prog", "total", "total_cost_net", "cost", "rem_mon"]
+SUM_COLUMNS = ["total", "cost", "total_cost_net", "rem_mon"]
+
+
+def read_trips(path, chunksize):
+    # 按块产出 DataFrame；CSV 真正分块读取，XLSX/JSON 一次读入后按块切分
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".csv":
+        yield from pd.read_csv(path, dtype=str, keep_default_na=False, chunksize=chunksize, encoding="utf-8-sig")
+        return
+    if ext in (".xlsx", ".xls"):
+        df = pd.read_excel(path, dtype=str, keep_default_na=False)
+    elif ext == ".json":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if isinstance(data, dict):  # 计算器保存的 {项目名: 配置}
+            data = [dict(cfg, name=name) for name, cfg in data.items() if isinstance(cfg, dict)]
+        df = pd.DataFrame(data)
+    else:
+        raise ValueError(f"不支持的文件类型：{path}")
+    for start in range(0, len(df), chunksize):
+        yield df.iloc[start:start + chunksize]
+
+
+def prepare(df):
+    df = df.rename(columns={c: COLUMN_ALIASES.get(str(c).strip(), c) for c in df.columns})
+    for key, value in DEFAULTS.items():
+        if key not in df.columns:
+            df[key] = value
+    return df
+
+
+def run(inputs, out_path, summary_path, today, group_by, chunksize):
+    summary = {}
+    collected = []
+    columns = None
+    first = True
+    rows = invalid = 0
+    started = time.perf_counter()
+    for path in inputs:
+        for chunk in read_trips(path, chunksize):
+            chunk = prepare(chunk)
+            res = calculate_batch(chunk, today)
+            res["start"] = res["start"].dt.strftime("%Y-%m-%d")
+            res["end"] = res["end"].dt.strftime("%Y-%m-%d")
+            out = pd.concat([chunk.reset_index(drop=True), res[RESULT_COLUMNS].reset_index(drop=True)], axis=1)
+            if "source_file" not in out.columns and len(inputs) > 1:
+                out.insert(0, "source_file", os.path.basename(path))
+            rows += len(out)
+            invalid += int((~out["valid"]).sum())
+
+            ok = out[out["valid"]]
+            if group_by and group_by not in ok.columns:
+                raise ValueError(f"输入文件缺少分组列：{group_by}")
+            keys = ok[group_by].astype(str) if group_by else pd.Series("全部", index=ok.index)
+            grouped = ok[SUM_COLUMNS].astype(float).groupby(keys)
+            sizes = grouped.size()
+            for key, sums in grouped.sum().iterrows():
+                acc = summary.setdefault(key, dict.fromkeys(["count"] + SUM_COLUMNS, 0.0))
+                acc["count"] += int(sizes[key])
+                for col in SUM_COLUMNS:
+                    acc[col] += sums[col]
+
+            if out_path and out_path.lower().endswith(".csv"):
+                # CSV 边算边追加，内存只占一块；列以第一块为准，多个输入文件表头不同时对齐到同一套列
+                columns = list(out.columns) if columns is None else columns
+                out.reindex(columns=columns).to_csv(out_path, mode="w" if first else "a", header=first, index=False,
+                           encoding="utf-8-sig" if first else "utf-8")
+            elif out_path:
+                collected.append(out)  # XLSX 不能追加，算完一次写出
+            first = False
+
+    if out_path and collected:
+        pd.concat(collected, ignore_index=True).to_excel(out_path, index=False)
+
+    summary_df = pd.DataFrame.from_dict(summary, orient="index")
+    summary_df.index.name = group_by or "汇总"
+    if not summary_df.empty:
+        summary_df["count"] = summary_df["count"].astype(int)
+    if summary_path:
+        if summary_path.lower().endswith(".csv"):
+            summary_df.to_csv(summary_path, encoding="utf-8-sig")
+        else:
+            summary_df.to_excel(summary_path)
+
+    elapsed = time.perf_counter() - started
+    print(f"共 {rows} 条记录（无效 {invalid} 条），用时 {elapsed:.2f}s")
+    print(summary_df.round(2).to_string())
+    return summary_df
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="出差补贴批量计算（无界面）")
+    parser.add_argument("inputs", nargs="+", help="输入文件：CSV / XLSX / JSON，可多个")
+    parser.add_argument("-o", "--out", help="逐条结果输出（.csv 边算边写，.xlsx 算完一次写出）")
+    parser.add_argument("-s", "--summary", help="汇总结果输出（.csv / .xlsx）")
+    parser.add_argument("--today", help="计算截止日期，默认今天此刻，如 2026-01-31")
+    parser.add_argument("--group-by", help="按此列分组汇总，如 员工")
+    parser.add_argument("--chunksize", type=int, default=50000, help="每块处理的记录数")
+    args = parser.parse_args(argv)
+
+    missing = [p for p in args.inputs if not os.path.exists(p)]
+    if missing:
+        parser.error(f"找不到输入文件：{', '.join(missing)}")
+    if args.today:
+        try:
+            as_datetime(args.today)
+        except ValueError:
+            parser.error(f"日期格式不正确：{args.today}")
+    run(args.inputs, args.out, args.summary, args.today, args.group_by, args.chunksize)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,490 @@
+import json
+import re
+from datetime import date, datetime, time
+from functools import lru_cache
+
+import numpy as np
+
+# ========= 出差补贴计算引擎：与界面无关，可单条计算，也可整表批量计算 =========
+# 批量计算的输入可以是 DataFrame、{列名: 序列} 字典，或项目配置字典的列表，
+# 列名与界面保存的项目配置一致（start_date、end_date、traffic ...）
+
+NUM_FIELDS = ("traffic", "house_fixed", "house_invoice", "other", "cost_day", "special_money", "special_days")
+DATE_FIELDS = ("start_date", "end_date")
+INPUT_FIELDS = DATE_FIELDS + NUM_FIELDS + ("house_type",)
+DAY_FIELDS = ("all", "diff", "remain")
+MONEY_FIELDS = ("prog", "total", "total_cost_net", "cost", "rem_mon")
+
+SECONDS_PER_DAY = 86400
+EPOCH = datetime(1970, 1, 1)
+_MISSING = object()
+# 日期后面跟着的时刻，如 Excel 日期单元格按文本读出的 "2026-03-01 00:00:00"
+_TIME_PART = re.compile(r"[ T]+\d{1,2}:\d{2}(:\d{2}(\.\d+)?)?$")
+
+
+def safe_float(val):
+    try:
+        return float(val) if val else 0.0
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def normalize_date(val):
+    # 支持 2026.1.5 / 2026/1/5 / 2026-1-5；表格导入的日期对象直接转成字符串，带时刻的只取日期部分
+    if isinstance(val, datetime):
+        return val.strftime("%Y-%m-%d")
+    if isinstance(val, date):
+        return val.isoformat()
+    if isinstance(val, str):
+        return _TIME_PART.sub("", val.strip()).replace('.', '-').replace('/', '-')
+    return None
+
+
+def parse_date(val):
+    return datetime.strptime(normalize_date(val), "%Y-%m-%d")
+
+
+def calculate_one(cfg, today=None):
+    # 单个项目计算，截止 today（默认此刻）；日期或字段有误时返回 None
+    try:
+        start_date = parse_date(cfg['start_date'])
+        end_date = parse_date(cfg['end_date'])
+        today = datetime.today() if today is None else as_datetime(today)
+
+        traffic_food = safe_float(cfg['traffic'])
+        house_fixed = safe_float(cfg['house_fixed'])
+        house_invoice = safe_float(cfg['house_invoice'])
+        other = safe_float(cfg['other'])
+        cost_day = safe_float(cfg['cost_day'])
+        special_money = safe_float(cfg['special_money'])
+        special_days = int(safe_float(cfg['special_days']))
+        house_type = int(cfg['house_type'])
+    except (KeyError, TypeError, ValueError, OverflowError):
+        return None
+
+    house = house_fixed if house_type == 1 else house_invoice
+
+    all_days = (end_date - start_date).days + 1
+    if today > end_date:
+        days_diff = all_days
+        remain_days = 0
+    else:
+        days_diff = (today - start_date).days + 1
+        remain_days = max(0, (end_date - today).days)
+
+    progress = 100 * (days_diff / all_days) if all_days > 0 else 0
+
+    total_money = (traffic_food + house + other) * (days_diff - special_days) + special_days * (special_money+traffic_food+other)
+    total_money_cost = (traffic_food + house + other - cost_day) * (days_diff - special_days) + special_days * (special_money+traffic_food+other-cost_day)
+    total_cost = days_diff * cost_day
+    remain_money = remain_days * (traffic_food + house + other)
+
+    return {
+        "start": start_date, "end": end_date, "all": all_days, "diff": days_diff,
+        "remain": remain_days, "prog": progress, "total": total_money,
+        "total_cost_net": total_money_cost, "cost": total_cost, "rem_mon": remain_money
+    }
+
+
+def as_datetime(value):
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime.combine(value, time())
+    return parse_date(value)
+
+
+# ================= 批量（向量化）计算 =================
+
+def factorize(values):
+    # 表格里的日期、金额大量重复：整列先归并成 (不同取值数组, 每行的下标)，
+    # 每个不同取值只转换一次，再用下标一次性铺回整列。
+    # pd.factorize 会把 None、nan、NaT、pd.NA 都当成空值不编号，而单条计算对它们并不一样（None 按 0、nan 得 nan），
+    # 所以空值按类型另外编号
+    import pandas as pd
+    arr = np.asarray(values, dtype=object).ravel()
+    index, uniques = pd.factorize(arr)
+    na = index < 0
+    if na.any():
+        blanks = arr[na]
+        kinds, _ = pd.factorize(np.frompyfunc(type, 1, 1)(blanks))
+        _, first = np.unique(kinds, return_index=True)
+        index[na] = len(uniques) + kinds
+        uniques = np.concatenate([np.asarray(uniques, dtype=object), blanks[first]])
+    return np.asarray(uniques, dtype=object), index
+
+
+def encode(values):
+    # 一列 → (不同取值, 每行下标)，每列只归并一次，缺失判断和类型转换共用；
+    # 本身就是数值/日期类型的列不必归并，下标为 None，取值即整列
+    arr = np.asarray(values)
+    if arr.dtype.kind in "iufbM":
+        return arr.ravel(), None
+    return factorize(arr)
+
+
+def expand(values, index):
+    return values if index is None else values[index]
+
+
+def parse_dates(column):
+    # 一列日期 → datetime64[D] 数组，无法解析的为 NaT；解析规则与单条计算的 strptime 相同
+    uniques, index = column
+    if uniques.dtype.kind == "M":
+        return expand(uniques.astype("datetime64[D]"), index)
+    parsed = np.full(len(uniques), np.datetime64("NaT"), dtype="datetime64[D]")
+    if uniques.dtype == object:
+        for i, v in enumerate(uniques):
+            try:
+                parsed[i] = np.datetime64(parse_date(v).date())
+            except (TypeError, ValueError):
+                pass
+    return expand(parsed, index)
+
+
+def to_floats(column):
+    uniques, index = column
+    if uniques.dtype.kind in "iufb":
+        return expand(uniques.astype(np.float64), index)
+    return expand(np.array([safe_float(v) for v in uniques.astype(object)], dtype=np.float64), index)
+
+
+def to_house_type(column):
+    # 与单条计算的 int(cfg['house_type']) 一致，转不了的记为无效
+    uniques, index = column
+    if uniques.dtype.kind in "iub":
+        return expand(uniques.astype(np.int64), index), expand(np.ones(uniques.size, dtype=bool), index)
+    if uniques.dtype.kind == "f":
+        ok = np.isfinite(uniques)
+        # 超出 int64 的值 int() 也能转，但肯定不等于 1，记成 -1 即可
+        out = np.where(ok & (np.abs(uniques) < 2.0 ** 62), np.trunc(uniques), -1).astype(np.int64)
+        return expand(out, index), expand(ok, index)
+    out = np.full(len(uniques), -1, dtype=np.int64)
+    ok = np.zeros(len(uniques), dtype=bool)
+    for i, v in enumerate(uniques.astype(object)):
+        try:
+            out[i] = int(v)
+            ok[i] = True
+        except (TypeError, ValueError, OverflowError):
+            pass
+    return expand(out, index), expand(ok, index)
+
+
+def trip_columns(trips):
+    # 统一成 ({列名: 序列}, 行数)；缺失的列/键记为 _MISSING，对应行视为无效
+    if hasattr(trips, "columns"):
+        n = len(trips)
+        return {k: trips[k].to_numpy() if k in trips.columns else [_MISSING] * n for k in INPUT_FIELDS}, n
+    if isinstance(trips, dict):
+        n = len(next(iter(trips.values()), []))
+        return {k: trips.get(k, [_MISSING] * n) for k in INPUT_FIELDS}, n
+    trips = list(trips)
+    return {k: [t.get(k, _MISSING) for t in trips] for k in INPUT_FIELDS}, len(trips)
+
+
+def missing_mask(column, n):
+    uniques, index = column
+    if index is None:
+        return np.zeros(n, dtype=bool)
+    return np.array([v is _MISSING for v in uniques], dtype=bool)[index]
+
+
+def calculate_batch(trips, today=None):
+    # 整表一次算完，逻辑与 calculate_one 逐条一致（浮点运算顺序也相同）
+    # 返回 {列名: 数组}，含 start/end、all/diff/remain、prog/total/total_cost_net/cost/rem_mon 和 valid；
+    # 无效行的天数为 0、金额为 NaN。输入是 DataFrame 时返回同索引的 DataFrame
+    cols, n = trip_columns(trips)
+    cols = {k: encode(v) for k, v in cols.items()}
+    valid = np.ones(n, dtype=bool)
+    for k in INPUT_FIELDS:
+        valid &= ~missing_mask(cols[k], n)
+
+    start = parse_dates(cols["start_date"])
+    end = parse_dates(cols["end_date"])
+    valid &= ~np.isnat(start) & ~np.isnat(end)
+
+    nums = {k: to_floats(cols[k]) for k in NUM_FIELDS}
+    valid &= np.isfinite(nums["special_days"])  # int(nan)/int(inf) 在单条计算里会报错
+    house_type, ok = to_house_type(cols["house_type"])
+    valid &= ok
+
+    today = datetime.today() if today is None else as_datetime(today)
+    today_s = (today - EPOCH).total_seconds()
+    safe_start = np.where(valid, start, np.datetime64(0, "D"))
+    safe_end = np.where(valid, end, np.datetime64(0, "D"))
+    start_s = safe_start.astype("datetime64[s]").astype(np.int64)
+    end_s = safe_end.astype("datetime64[s]").astype(np.int64)
+
+    traffic_food, other, cost_day = nums["traffic"], nums["other"], nums["cost_day"]
+    special_money = nums["special_money"]
+    special_days = np.trunc(np.where(valid, nums["special_days"], 0)).astype(np.int64)
+    house = np.where(house_type == 1, nums["house_fixed"], nums["house_invoice"])
+
+    all_days = (safe_end - safe_start).astype(np.int64) + 1
+    ended = today_s > end_s
+    days_diff = np.where(ended, all_days, np.floor_divide(today_s - start_s, SECONDS_PER_DAY).astype(np.int64) + 1)
+    remain_days = np.where(ended, 0, np.maximum(0, np.floor_divide(end_s - today_s, SECONDS_PER_DAY).astype(np.int64)))
+
+    progress = np.zeros(n, dtype=np.float64)
+    np.divide(days_diff, all_days, out=progress, where=all_days > 0)
+    progress = np.where(all_days > 0, 100 * progress, 0.0)
+
+    # 金额里填了 inf/nan 时与单条计算一样得到 nan，不必告警
+    with np.errstate(invalid="ignore", over="ignore"):
+        daily = traffic_food + house + other
+        total_money = daily * (days_diff - special_days) + special_days * (special_money+traffic_food+other)
+        total_money_cost = (daily - cost_day) * (days_diff - special_days) + special_days * (special_money+traffic_food+other-cost_day)
+        total_cost = days_diff * cost_day
+        remain_money = remain_days * daily
+
+    result = {"start": start, "end": end}
+    for k, v in zip(DAY_FIELDS, (all_days, days_diff, remain_days)):
+        result[k] = np.where(valid, v, 0)
+    for k, v in zip(MONEY_FIELDS, (progress, total_money, total_money_cost, total_cost, remain_money)):
+        result[k] = np.where(valid, v, np.nan)
+    result["valid"] = valid
+
+    if hasattr(trips, "columns"):
+        import pandas as pd
+        return pd.DataFrame(result, index=trips.index)
+    return result
+
+
+# ================= 分段费率（规则表）计算 =================
+# 项目配置里可加 "rules"：按日期区间覆盖日费率的列表，后写的规则优先，例如
+#   "rules": [{"start": "2026-03-01", "end": "2026-03-31", "house": 450},   # 该月换城市，房补标准不同
+#             {"start": "2026-05-01", "traffic": 200}]                      # 5 月起调标准，缺省 end 表示到行程结束
+# 可覆盖的字段：traffic、house、other、cost_day；未覆盖的沿用项目本身的费率（house 按房补方式取包干或节支）。
+# 表格输入里没有填 rules 的行（空值 / nan）按没有规则计算；CSV 里的 rules 写成 JSON 文本。
+# 旧字段 special_money/special_days（只有天数、没有日期）换算成行程头 special_days 天 house=special_money 的规则，
+# 排在所有规则之前（优先级最低）；已出差天数不少于特殊天数时与单条计算结果相同。
+# 要按日期指定特殊房补，直接写 house 规则，并把 special_days 填 0。
+# 每个行程先切成费率不变的若干段，再对段做前缀和；查询任意截止日只需二分找到所在段，
+# 与行程天数无关，不按天循环。截止日早于开始日时累计为 0（单条计算会得到负数）；
+# 剩余天数 = 总天数 - 已计天数（单条计算在 today 带时刻时会少算一天）。
+
+RATE_FIELDS = ("traffic", "house", "other", "cost_day")
+DAY_OFFSET = 1 << 30   # 日序号平移成正数，便于与行程序号拼成一个排序键
+TRIP_STRIDE = 1 << 32
+
+
+@lru_cache(maxsize=65536)
+def day_number(val):
+    # 日期 → 1970-01-01 起的天数
+    return (parse_date(val) - EPOCH).days
+
+
+def rule_list(value):
+    # rules 只接受列表；None、nan、空串视为没有规则，字符串按 JSON 解析，其他类型报错（行程判为无效）
+    if value is None or (isinstance(value, float) and value != value):
+        return []
+    if isinstance(value, str):
+        if not value.strip():
+            return []
+        value = json.loads(value)
+    if not isinstance(value, (list, tuple)):
+        raise TypeError(f"rules 应为列表：{value!r}")
+    return value
+
+
+def resolve_rules(cfg):
+    # 单个行程 → (开始日序号, 结束日序号, [(段起始日序号, 段天数, 日补贴, 日支出), ...])；配置有误时返回 None
+    try:
+        s = day_number(cfg['start_date'])
+        e = day_number(cfg['end_date'])
+        base = {k: safe_float(cfg[k]) for k in ("traffic", "other", "cost_day")}
+        base["house"] = safe_float(cfg['house_fixed'] if int(cfg['house_type']) == 1 else cfg['house_invoice'])
+        rules = []
+        special_days = int(safe_float(cfg.get('special_days')))
+        if special_days > 0:
+            rules.append((s, min(s + special_days, e + 1), {"house": safe_float(cfg.get('special_money'))}))
+        for rule in rule_list(cfg.get("rules")):
+            a = day_number(rule["start"]) if rule.get("start") else s
+            b = day_number(rule["end"]) if rule.get("end") else e
+            a, b = max(a, s), min(b, e) + 1  # 裁到行程范围内，b 为不含的结束
+            if a < b:
+                rules.append((a, b, {k: safe_float(rule[k]) for k in RATE_FIELDS if k in rule}))
+    except (KeyError, TypeError, ValueError, OverflowError, AttributeError):
+        return None
+
+    segments = []
+    if e >= s:
+        cuts = sorted({s, e + 1}.union(*((a, b) for a, b, _ in rules)))
+        for a, b in zip(cuts, cuts[1:]):
+            rate = dict(base)
+            for ra, rb, values in rules:
+                if ra <= a < rb:
+                    rate.update(values)
+            segments.append((a, b - a, rate["traffic"] + rate["house"] + rate["other"], rate["cost_day"]))
+    return s, e, segments
+
+
+class RuleTable:
+    # 一批行程的分段费率表；所有行程的段拼在一起，按 (行程序号, 段起始日) 排序
+    def __init__(self, trips):
+        self.count = 0
+        starts, ends, valid = [], [], []
+        seg_trip, seg_start, seg_len, seg_allow, seg_cost = [], [], [], [], []
+        for i, cfg in enumerate(trips):
+            resolved = resolve_rules(cfg)
+            valid.append(resolved is not None)
+            s, e, segments = resolved if resolved else (0, -1, [])
+            starts.append(s)
+            ends.append(e)
+            for a, n, allow, cost in segments:
+                seg_trip.append(i)
+                seg_start.append(a)
+                seg_len.append(n)
+                seg_allow.append(allow)
+                seg_cost.append(cost)
+            self.count = i + 1
+
+        self.start = np.array(starts, dtype=np.int64)
+        self.end = np.array(ends, dtype=np.int64)
+        self.valid = np.array(valid, dtype=bool)
+        self.seg_trip = np.array(seg_trip, dtype=np.int64)
+        self.seg_start = np.array(seg_start, dtype=np.int64)
+        self.seg_len = np.array(seg_len, dtype=np.int64)
+        self.seg_allow = np.array(seg_allow, dtype=np.float64)
+        self.seg_cost = np.array(seg_cost, dtype=np.float64)
+        self.keys = self.seg_trip * TRIP_STRIDE + self.seg_start + DAY_OFFSET
+
+        # 每段之前（同一行程内）的累计天数/补贴/支出
+        self.cum_days = self.prefix(self.seg_len.astype(np.float64))
+        with np.errstate(invalid="ignore", over="ignore"):
+            self.cum_allow = self.prefix(self.seg_allow * self.seg_len)
+            self.cum_cost = self.prefix(self.seg_cost * self.seg_len)
+
+    def prefix(self, values):
+        # 分行程的前缀和（不含本段），每个行程从 0 重新累加：某个行程的 nan/inf 费率不会带坏后面的行程，
+        # 浮点误差也不会跨行程累积。按「段在行程内的序号」逐层推进，循环次数 = 单个行程的最多段数
+        out = np.zeros(values.size)
+        if not values.size:
+            return out
+        first = np.ones(values.size, dtype=bool)
+        first[1:] = self.seg_trip[1:] != self.seg_trip[:-1]
+        pos = np.arange(values.size) - np.maximum.accumulate(np.where(first, np.arange(values.size), 0))
+        order = np.argsort(pos, kind="stable")
+        bounds = np.searchsorted(pos[order], np.arange(pos.max() + 2))
+        for k in range(1, pos.max() + 1):
+            idx = order[bounds[k]:bounds[k + 1]]
+            out[idx] = out[idx - 1] + values[idx - 1]
+        return out
+
+    def accrued(self, trip, day):
+        # 行程 trip 截止 day（含当天，日序号）的累计 (天数, 补贴, 支出)；trip、day 可为等长数组
+        trip = np.asarray(trip, dtype=np.int64)
+        day = np.asarray(day, dtype=np.int64)
+        if not self.keys.size:
+            zeros = np.zeros(np.broadcast(trip, day).shape)
+            return zeros, zeros, zeros
+        idx = np.searchsorted(self.keys, trip * TRIP_STRIDE + day + DAY_OFFSET, side="right") - 1
+        safe = np.maximum(idx, 0)
+        hit = (idx >= 0) & (self.seg_trip[safe] == trip)
+        n = np.minimum(day - self.seg_start[safe] + 1, self.seg_len[safe])
+        with np.errstate(invalid="ignore", over="ignore"):
+            days = np.where(hit, self.cum_days[safe] + n, 0.0)
+            allow = np.where(hit, self.cum_allow[safe] + self.seg_allow[safe] * n, 0.0)
+            cost = np.where(hit, self.cum_cost[safe] + self.seg_cost[safe] * n, 0.0)
+        return days, allow, cost
+
+
+def calculate_rules(trips, today=None):
+    # 按规则表计算截止 today（按日期，含当天）的结果，字段与 calculate_batch 相同
+    as_df = hasattr(trips, "columns")
+    records = trips.to_dict("records") if as_df else list(trips)
+    table = RuleTable(records)
+    today = datetime.today() if today is None else as_datetime(today)
+    today_n = (today - EPOCH).days
+    idx = np.arange(table.count)
+
+    days, total, cost = table.accrued(idx, np.full(table.count, today_n))
+    _, full_allow, _ = table.accrued(idx, table.end)
+    all_days = np.maximum(table.end - table.start + 1, 0)
+    days = days.astype(np.int64)
+    valid = table.valid
+    with np.errstate(invalid="ignore", over="ignore"):
+        result = {
+            "start": np.where(valid, table.start, 0).astype("datetime64[D]"),
+            "end": np.where(valid, table.end, 0).astype("datetime64[D]"),
+            "all": np.where(valid, all_days, 0),
+            "diff": np.where(valid, days, 0),
+            "remain": np.where(valid, all_days - days, 0),
+            "prog": np.where(valid, 100 * days / np.maximum(all_days, 1), np.nan),
+            "total": np.where(valid, total, np.nan),
+            "total_cost_net": np.where(valid, total - cost, np.nan),
+            "cost": np.where(valid, cost, np.nan),
+            "rem_mon": np.where(valid, full_allow - total, np.nan),
+            "valid": valid,
+        }
+    result["start"][~valid] = np.datetime64("NaT")
+    result["end"][~valid] = np.datetime64("NaT")
+
+    if as_df:
+        import pandas as pd
+        return pd.DataFrame(result, index=trips.index)
+    return result
+
+
+# ================= 补贴累计曲线（按日/按月） =================
+
+def accrual_series(trips, start, end, freq="D", per_trip=False):
+    # 一次算出 [start, end] 内每天（freq="D"）或每月末（freq="M"，最后一期截到 end）的整体累计曲线，
+    # 按规则表口径（见上）。整体曲线用差分数组：每段在起止日各记一笔，cumsum 得到每天的补贴，
+    # 耗时与段数 + 天数成正比，与行程数 × 天数无关。
+    # 返回 {"date", "trip_days", "allowance", "cost"（以上为每期新增）, "total", "total_cost", "net"（截至期末累计）,
+    # "excluded"（费率不是有限数值、未计入整体曲线的行程数，否则一个 nan 就会让整条曲线都成 nan）}；
+    # per_trip=True 时另有 "per_trip"：行程数 × 期数的累计补贴矩阵（行程多、期数多时注意内存）
+    table = trips if isinstance(trips, RuleTable) else RuleTable(
+        trips.to_dict("records") if hasattr(trips, "columns") else list(trips))
+    s = (as_datetime(start) - EPOCH).days
+    e = (as_datetime(end) - EPOCH).days
+    if e < s:
+        raise ValueError("结束日期早于开始日期")
+    k = e - s + 1
+
+    finite = np.isfinite(table.seg_allow) & np.isfinite(table.seg_cost)
+    excluded = np.zeros(table.count, dtype=bool)
+    excluded[table.seg_trip[~finite]] = True
+    lo = np.clip(table.seg_start, s, e + 1) - s
+    hi = np.clip(table.seg_start + table.seg_len, s, e + 1) - s
+    keep = (lo < hi) & ~excluded[table.seg_trip]
+    lo, hi = lo[keep], hi[keep]
+    with np.errstate(invalid="ignore", over="ignore"):
+        def daily(weights):
+            return np.cumsum(np.bincount(lo, weights, k + 1) - np.bincount(hi, weights, k + 1))[:k]
+        trip_days = daily(np.ones(lo.size))
+        allowance = daily(table.seg_allow[keep])
+        cost = daily(table.seg_cost[keep])
+        # start 之前已累计的部分
+        idx = np.arange(table.count)
+        _, base_allow, base_cost = table.accrued(idx, np.full(table.count, s - 1))
+        total = base_allow[~excluded].sum() + np.cumsum(allowance)
+        total_cost = base_cost[~excluded].sum() + np.cumsum(cost)
+
+    dates = np.arange(s, e + 1).astype("datetime64[D]")
+    if freq == "D":
+        pick = np.arange(k)
+    elif freq == "M":
+        month_end = (dates + 1).astype("datetime64[M]") != dates.astype("datetime64[M]")
+        month_end[-1] = True
+        pick = np.flatnonzero(month_end)
+    else:
+        raise ValueError(f"不支持的频率：{freq}")
+
+    def per_period(values):
+        return np.diff(np.concatenate(([0.0], np.cumsum(values)[pick])))
+
+    result = {
+        "date": dates[pick],
+        "trip_days": per_period(trip_days).round().astype(np.int64),
+        "allowance": per_period(allowance),
+        "cost": per_period(cost),
+        "total": total[pick],
+        "total_cost": total_cost[pick],
+        "net": total[pick] - total_cost[pick],
+        "excluded": int(excluded.sum()),
+    }
+    if per_trip:
+        _, result["per_trip"], _ = table.accrued(np.arange(table.count)[:, None], (s + pick)[None, :])
+    return result
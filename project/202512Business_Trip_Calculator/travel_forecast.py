@@ -0,0 +1,112 @@
+import argparse
+import os
+import sys
+
+import pandas as pd
+
+from travel_batch import prepare, read_trips
+from travel_engine import RuleTable, accrual_series, as_datetime
+
+# ========= 出差补贴累计曲线 / 现金流预测（无界面）=========
+# 一次算出某段时间内每天或每月的补贴累计，用于预测现金流。示例：
+#   python travel_forecast.py trips.json --from 2026-01-01 --to 2026-12-31 --freq M -o 月度.csv --chart 月度.png
+# 不给 --from/--to 时取所有行程的最早开始日到最晚结束日；口径同分段费率（规则表）计算
+
+SERIES_COLUMNS = {
+    "date": "日期", "trip_days": "出差人天", "allowance": "本期补贴", "cost": "本期支出",
+    "total": "累计补贴", "total_cost": "累计支出", "net": "累计净补贴",
+}
+
+
+def load_portfolio(inputs):
+    frames = [prepare(chunk) for path in inputs for chunk in read_trips(path, 50000)]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+def series_frame(series):
+    df = pd.DataFrame({label: series[key] for key, label in SERIES_COLUMNS.items()})
+    df["日期"] = pd.to_datetime(df["日期"]).dt.strftime("%Y-%m-%d")
+    return df
+
+
+def per_trip_frame(series, names):
+    dates = pd.to_datetime(series["date"]).strftime("%Y-%m-%d")
+    return pd.DataFrame(series["per_trip"], index=names, columns=dates)
+
+
+def save_chart(df, path, title):
+    # matplotlib 为可选依赖，没装时只提示不报错
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("未安装 matplotlib，跳过图表输出")
+        return
+    plt.rcParams["font.sans-serif"] = ["Microsoft YaHei", "SimHei", "DejaVu Sans"]
+    plt.rcParams["axes.unicode_minus"] = False
+    dates = pd.to_datetime(df["日期"])
+    fig, ax = plt.subplots(figsize=(10, 5))
+    ax.plot(dates, df["累计补贴"], label="累计补贴")
+    ax.plot(dates, df["累计净补贴"], label="累计净补贴")
+    ax.bar(dates, df["本期补贴"], width=20 if len(df) < 60 else 1, alpha=0.3, label="本期补贴")
+    ax.set_title(title)
+    ax.set_ylabel("元")
+    ax.legend()
+    fig.autofmt_xdate()
+    fig.tight_layout()
+    fig.savefig(path, dpi=120)
+    plt.close(fig)
+    print(f"图表已写入：{path}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="出差补贴累计曲线 / 现金流预测")
+    parser.add_argument("inputs", nargs="+", help="输入文件：CSV / XLSX / JSON，可多个")
+    parser.add_argument("--from", dest="start", help="曲线起始日期，如 2026-01-01")
+    parser.add_argument("--to", dest="end", help="曲线结束日期，如 2026-12-31")
+    parser.add_argument("--freq", choices=["D", "M"], default="M", help="D 按日，M 按月（默认）")
+    parser.add_argument("-o", "--out", help="整体曲线输出（.csv / .xlsx）")
+    parser.add_argument("--per-trip", help="逐行程累计矩阵输出（.csv），行为行程、列为日期")
+    parser.add_argument("--chart", help="曲线图输出（.png / .svg，需要 matplotlib）")
+    args = parser.parse_args(argv)
+
+    missing = [p for p in args.inputs if not os.path.exists(p)]
+    if missing:
+        parser.error(f"找不到输入文件：{', '.join(missing)}")
+    for value in (args.start, args.end):
+        if value:
+            try:
+                as_datetime(value)
+            except ValueError:
+                parser.error(f"日期格式不正确：{value}")
+
+    trips = load_portfolio(args.inputs)
+    table = RuleTable(trips.to_dict("records"))
+    if not table.valid.any():
+        sys.exit("没有可计算的行程")
+    start = args.start or pd.Timestamp(table.start[table.valid].min(), unit="D")
+    end = args.end or pd.Timestamp(table.end[table.valid].max(), unit="D")
+    series = accrual_series(table, start, end, args.freq, per_trip=bool(args.per_trip))
+    if series["excluded"]:
+        print(f"有 {series['excluded']} 个行程的费率不是有效数字，未计入曲线")
+
+    df = series_frame(series)
+    if args.out:
+        if args.out.lower().endswith(".csv"):
+            df.to_csv(args.out, index=False, encoding="utf-8-sig")
+        else:
+            df.to_excel(args.out, index=False)
+        print(f"曲线已写入：{args.out}")
+    if args.per_trip:
+        names = trips["name"].astype(str) if "name" in trips.columns else trips.index
+        per_trip_frame(series, names).to_csv(args.per_trip, encoding="utf-8-sig")
+        print(f"逐行程累计已写入：{args.per_trip}")
+    if args.chart:
+        save_chart(df, args.chart, f"出差补贴累计（{df['日期'].iloc[0]} ~ {df['日期'].iloc[-1]}）")
+    print(df.round(2).to_string(index=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
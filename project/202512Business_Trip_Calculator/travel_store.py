@@ -0,0 +1,267 @@
+import json
+import os
+import shutil
+import sqlite3
+import time
+from contextlib import contextmanager
+
+# ========= 项目记录存储：快照 + 追加日志 =========
+# 快照就是原来的 travel_records_v7.json（格式不变，旧版本照样能读）；
+# 每次新增/修改/删除/改名只往旁边的 .journal 追加一行，不再整文件重写。
+# 日志攒到一定条数（或程序退出）时合并进快照：先写临时文件再改名替换，最后清空日志。
+# 中途崩溃时：快照要么是旧的要么是新的；日志最后半行写坏的直接丢弃；
+# 快照已替换但日志还没清空时重放一遍也无妨（每条操作重复执行结果相同）。
+# 读取失败（快照损坏、被同步盘/杀毒软件锁住）时：损坏的快照先复制一份备份，之后的修改照常追加日志，
+# 但不再自动合并——内存里不是完整记录，合并会把真正的快照覆盖掉；下次读取成功时日志会重放到原记录上。
+
+COMPACT_EVERY = 200  # 日志超过这么多条就合并一次快照
+
+
+class JournalStore:
+    def __init__(self, path, compact_every=COMPACT_EVERY):
+        self.path = path
+        self.journal_path = os.path.splitext(path)[0] + ".journal"
+        self.compact_every = compact_every
+        self.pending = 0  # 日志里尚未合并的条数
+        self.load_failed = False
+        self.backup_path = None  # 损坏快照的备份位置
+        self.data = {}
+
+    def load(self):
+        # 读快照，再按顺序重放日志；快照不存在时返回空字典，快照损坏则备份后抛出 ValueError
+        self.load_failed = True  # 完整读完才清掉
+        data = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except ValueError:
+                self.backup_path = self.backup()
+                raise
+        self.pending = 0
+        if os.path.exists(self.journal_path):
+            good = 0  # 最后一条完整记录的结尾位置
+            with open(self.journal_path, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # 崩溃时写了一半的最后一行
+                    try:
+                        op = json.loads(line.decode("utf-8"))
+                    except ValueError:
+                        break
+                    apply_op(data, op)
+                    self.pending += 1
+                    good += len(line)
+            if good < os.path.getsize(self.journal_path):
+                # 截掉坏尾巴，否则之后追加的记录会接在半行后面一起读不出来
+                with open(self.journal_path, "r+b") as f:
+                    f.truncate(good)
+        self.data = data
+        self.load_failed = False
+        return data
+
+    def backup(self):
+        root, ext = os.path.splitext(self.path)
+        backup_path = f"{root}.unreadable-{time.strftime('%Y%m%d-%H%M%S')}{ext}"
+        try:
+            shutil.copy2(self.path, backup_path)
+        except OSError:
+            return None
+        return backup_path
+
+    # expected：界面读入该项目时的版本号，本地单人存储不检查
+    def version(self, name):
+        return None
+
+    def put(self, name, cfg, expected=None):
+        self.append({"op": "put", "name": name, "cfg": cfg})
+
+    def delete(self, name, expected=None):
+        self.append({"op": "del", "name": name})
+
+    def rename(self, old, new, cfg, expected=None):
+        self.append({"op": "rename", "old": old, "new": new, "cfg": cfg})
+
+    def append(self, op):
+        apply_op(self.data, op)
+        with open(self.journal_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(op, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.pending += 1
+        if self.pending >= self.compact_every and not self.load_failed:
+            self.compact()
+
+    def poll_changes(self):
+        # 本地单人存储，没有别人的修改
+        return []
+
+    def compact(self, data=None):
+        # 把当前全部记录写成新快照，然后清空日志
+        if data is not None:
+            self.data = data
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self.pending = 0
+
+
+def apply_op(data, op):
+    kind = op.get("op")
+    if kind == "put":
+        data[op["name"]] = op["cfg"]
+    elif kind == "del":
+        data.pop(op["name"], None)
+    elif kind == "rename":
+        data.pop(op["old"], None)
+        data[op["new"]] = op["cfg"]
+
+
+# ========= 多人共用存储：SQLite =========
+# 放在共享盘上供多人同时编辑。每个项目一行，带版本号：保存时只有库里的版本与自己读到的一致才写入，
+# 否则抛出 ConflictError（别人先改了），并把本地这条换成库里最新的。
+# 「自己读到的版本」由调用方传入（expected，界面打开该项目时记下的版本）：后台拉取会更新 versions，
+# 但编辑框里还是旧内容，若拿 versions 去比就会把别人的修改悄悄覆盖掉。
+# 本地的 data/versions 只在事务提交成功后才改，回滚时保持原样。
+# 删除只打标记不真删；每次写入分配一个递增的 seq，其他客户端按 seq 只拉取变化的记录。
+# 默认用回滚日志（journal_mode=DELETE），靠 SQLite 自带的文件锁和 busy_timeout 排队：
+# WAL 依赖各进程共享的内存映射，多台机器经共享盘（UNC 路径或映射的盘符都一样）访问同一个库时不安全，
+# 从路径上也分辨不出是不是网络盘。确定只在一台机器上多开时可传 wal=True，读写互不阻塞。
+
+class ConflictError(Exception):
+    def __init__(self, name):
+        super().__init__(f"项目已被其他人修改或删除：{name}")
+        self.name = name
+
+
+_KNOWN = object()  # expected 的缺省值：按本地记下的版本比对
+
+
+class SharedStore:
+    def __init__(self, path, timeout=10, wal=False):
+        self.path = path
+        self.data = {}
+        self.versions = {}  # {项目名: 读到的版本号}
+        self.last_seq = 0
+        self.data_version = None
+        self.staged = []  # 事务中待提交后写回本地的 (项目名, 配置或 None, 版本号)
+        # 自己管理事务；连接在后台加载线程里也会用到，但同一时间只有一个线程使用
+        self.conn = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self.conn.execute(f"PRAGMA journal_mode={'WAL' if wal else 'DELETE'}")
+        self.conn.execute(f"PRAGMA busy_timeout={int(timeout * 1000)}")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS projects (
+                name TEXT PRIMARY KEY,
+                cfg TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                deleted INTEGER NOT NULL DEFAULT 0,
+                seq INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS projects_seq ON projects(seq);
+        """)
+
+    def load(self):
+        self.data, self.versions, self.last_seq = {}, {}, 0
+        self.data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        self.apply_rows(self.conn.execute("SELECT name, cfg, version, deleted, seq FROM projects"))
+        return self.data
+
+    def poll_changes(self):
+        # 拉取别人改过的记录，返回变化的项目名；库没动过时只查一次 data_version
+        try:
+            version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+            if version == self.data_version:
+                return []
+            rows = self.conn.execute(
+                "SELECT name, cfg, version, deleted, seq FROM projects WHERE seq > ? ORDER BY seq",
+                (self.last_seq,)).fetchall()
+        except sqlite3.OperationalError:
+            return []  # 库被锁住或共享盘暂时连不上，下次再拉
+        self.data_version = version
+        return self.apply_rows(rows)
+
+    def apply_rows(self, rows):
+        changed = []
+        for name, cfg, version, deleted, seq in rows:
+            if deleted:
+                self.data.pop(name, None)
+                self.versions.pop(name, None)
+            else:
+                self.data[name] = json.loads(cfg)
+                self.versions[name] = version
+            self.last_seq = max(self.last_seq, seq)
+            changed.append(name)
+        return changed
+
+    def version(self, name):
+        return self.versions.get(name)
+
+    def put(self, name, cfg, expected=_KNOWN):
+        with self.transaction():
+            self.write(name, cfg, expected)
+
+    def delete(self, name, expected=_KNOWN):
+        with self.transaction():
+            self.write(name, None, expected)
+
+    def rename(self, old, new, cfg, expected=_KNOWN):
+        # expected 指 old 的版本；new 按本地记下的版本比对
+        with self.transaction():
+            self.write(old, None, expected)
+            self.write(new, cfg)
+
+    def compact(self, data=None):
+        # 共享库不整体重写；用 WAL 时退出前顺便合并回主库
+        try:
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except sqlite3.OperationalError:
+            pass  # 别人正在读写时合并不了，下次再说
+
+    @contextmanager
+    def transaction(self):
+        # BEGIN IMMEDIATE 先拿写锁，检查版本与写入之间不会被别人插队
+        self.conn.execute("BEGIN IMMEDIATE")
+        self.staged = []
+        try:
+            yield
+            self.conn.execute("COMMIT")
+        except BaseException:
+            if self.conn.in_transaction:
+                self.conn.execute("ROLLBACK")
+            self.staged = []
+            raise
+        for name, cfg, version in self.staged:
+            self.set_local(name, cfg, version)
+        self.staged = []
+
+    def set_local(self, name, cfg, version):
+        if cfg is None:
+            self.data.pop(name, None)
+            self.versions.pop(name, None)
+        else:
+            self.data[name] = cfg
+            self.versions[name] = version
+
+    def write(self, name, cfg, expected=_KNOWN):
+        # cfg 为 None 表示删除
+        if expected is _KNOWN:
+            expected = self.versions.get(name)
+        row = self.conn.execute("SELECT cfg, version, deleted FROM projects WHERE name = ?", (name,)).fetchone()
+        current = row[1] if row and not row[2] else None  # 库里现存的版本，已删除/不存在为 None
+        if current != expected:
+            # 冲突时本地这条换成库里已提交的内容（不受本事务影响），随后事务回滚
+            self.set_local(name, json.loads(row[0]) if current is not None else None, current)
+            if cfg is None and current is None:
+                return  # 要删的别人已经删了
+            raise ConflictError(name)
+        seq = self.conn.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM projects").fetchone()[0]
+        version = (row[1] if row else 0) + 1
+        self.conn.execute(
+            "INSERT OR REPLACE INTO projects (name, cfg, version, deleted, seq) VALUES (?, ?, ?, ?, ?)",
+            (name, json.dumps(cfg if cfg is not None else {}, ensure_ascii=False), version, int(cfg is None), seq))
+        self.staged.append((name, cfg, version))
@@ -0,0 +1,131 @@
+import tkinter as tk
+from bisect import bisect_left
+from tkinter import ttk
+
+# ========= 大量项目时用的列表控件 =========
+# VirtualList：在 Canvas 上只画可见的那几行，滚动时复用同一批文字项，
+# 几千个项目也只有十几个画布元素；checkable=True 时每行前面带勾选框
+# PrefixIndex：项目名排序后二分查找前缀，搜索框每输入一个字不必扫全表
+
+
+class PrefixIndex:
+    def __init__(self, names):
+        # 按不区分大小写的键排序，同键再按原名排序
+        self.keys = sorted((name.casefold(), name) for name in names)
+
+    def search(self, prefix):
+        if not prefix:
+            return [name for _, name in self.keys]
+        p = prefix.casefold()
+        lo = bisect_left(self.keys, (p,))
+        hi = bisect_left(self.keys, (p + "\U0010ffff",))
+        return [name for _, name in self.keys[lo:hi]]
+
+
+class VirtualList(tk.Frame):
+    def __init__(self, parent, row_height=20, font=("微软雅黑", 9), checkable=False,
+                 on_select=None, on_toggle=None, **kw):
+        super().__init__(parent, **kw)
+        self.row_height = row_height
+        self.font = font
+        self.checkable = checkable
+        self.on_select = on_select    # on_select(name)：单击某行
+        self.on_toggle = on_toggle    # on_toggle(name, checked)：勾选状态改变
+        self.items = []
+        self.colors = {}              # {名称: 文字颜色}，没有的用黑色
+        self.checked = set()
+        self.selected = None
+        self.offset = 0               # 顶部滚出去的像素数
+
+        self.canvas = tk.Canvas(self, bg="white", highlightthickness=0)
+        self.scroll = ttk.Scrollbar(self, orient="vertical", command=self.yview)
+        self.canvas.pack(side="left", fill="both", expand=True)
+        self.scroll.pack(side="right", fill="y")
+        self.highlight = self.canvas.create_rectangle(0, 0, 0, 0, fill="#cce8ff", outline="", state="hidden")
+        self.rows = []                # 复用的文字项
+
+        self.canvas.bind("<Configure>", lambda e: self.redraw())
+        self.canvas.bind("<Button-1>", self.on_click)
+        self.canvas.bind("<MouseWheel>", lambda e: self.yview("scroll", -1 if e.delta > 0 else 1, "units"))
+        self.canvas.bind("<Button-4>", lambda e: self.yview("scroll", -1, "units"))
+        self.canvas.bind("<Button-5>", lambda e: self.yview("scroll", 1, "units"))
+
+    def set_items(self, items, colors=None):
+        self.items = list(items)
+        if colors is not None:
+            self.colors = colors
+        self.offset = 0
+        self.redraw()
+
+    def set_checked(self, names):
+        self.checked = set(names)
+        self.redraw()
+
+    def checked_items(self):
+        return [name for name in self.items if name in self.checked]
+
+    def select(self, name):
+        self.selected = name
+        self.redraw()
+
+    def max_offset(self):
+        return max(0, len(self.items) * self.row_height - self.canvas.winfo_height())
+
+    def yview(self, *args):
+        # 与 Scrollbar 的 command 协议一致："moveto" 比例 / "scroll" 数量 单位
+        if args[0] == "moveto":
+            self.offset = float(args[1]) * len(self.items) * self.row_height
+        elif args[0] == "scroll":
+            step = self.row_height if args[2] == "units" else self.canvas.winfo_height()
+            self.offset += int(args[1]) * step
+        self.offset = int(min(max(self.offset, 0), self.max_offset()))
+        self.redraw()
+
+    def redraw(self):
+        height = self.canvas.winfo_height()
+        rh = self.row_height
+        first = self.offset // rh
+        visible = height // rh + 2
+        while len(self.rows) < visible:
+            self.rows.append(self.canvas.create_text(4, 0, anchor="nw", font=self.font))
+        for slot, item_id in enumerate(self.rows):
+            index = first + slot
+            if slot >= visible or index >= len(self.items):
+                self.canvas.itemconfig(item_id, state="hidden")
+                continue
+            name = self.items[index]
+            text = ("☑ " if name in self.checked else "☐ ") + name if self.checkable else name
+            self.canvas.coords(item_id, 4, index * rh - self.offset + 2)
+            self.canvas.itemconfig(item_id, text=text, fill=self.colors.get(name, "black"), state="normal")
+
+        if self.selected in self.items[first:first + visible]:
+            top = self.items.index(self.selected, first) * rh - self.offset
+            self.canvas.coords(self.highlight, 0, top, self.canvas.winfo_width(), top + rh)
+            self.canvas.itemconfig(self.highlight, state="normal")
+        else:
+            self.canvas.itemconfig(self.highlight, state="hidden")
+
+        total = len(self.items) * rh
+        if total <= height or total == 0:
+            self.scroll.set(0, 1)
+        else:
+            self.scroll.set(self.offset / total, (self.offset + height) / total)
+
+    def on_click(self, event):
+        index = (self.offset + event.y) // self.row_height
+        if not 0 <= index < len(self.items):
+            return
+        name = self.items[index]
+        if self.checkable:
+            checked = name not in self.checked
+            if checked:
+                self.checked.add(name)
+            else:
+                self.checked.discard(name)
+            self.redraw()
+            if self.on_toggle:
+                self.on_toggle(name, checked)
+        else:
+            self.select(name)
+            if self.on_select:
+                self.on_select(name)
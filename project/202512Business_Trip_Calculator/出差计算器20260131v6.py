@@ -1,8 +1,16 @@
-import json
+import time
+STARTUP_T0 = time.perf_counter()  # 启动计时起点，尽量放在最前面
+
 import os
-from datetime import datetime
+import sqlite3
+import sys
+import threading
+from datetime import date, datetime
 import tkinter as tk
-from tkinter import messagebox, ttk
+from tkinter import messagebox
+
+from travel_store import ConflictError, JournalStore, SharedStore
+from travel_widgets import PrefixIndex, VirtualList
 
 # ========= 方案 C：系统用户数据目录配置 =========
 def get_config_path():
@@ -15,28 +23,132 @@ def get_config_path():
     return os.path.join(app_data_dir, "travel_records_v7.json")
 
 CONFIG_FILE = get_config_path()
+# 团队共用：把环境变量 TRAVEL_SHARED_DB 设为共享盘上的 .db 文件，多人同时编辑同一份记录
+SHARED_DB = os.environ.get("TRAVEL_SHARED_DB", "")
+# 共享库只在本机多开时才可设 TRAVEL_SHARED_WAL=1 启用 WAL；经共享盘多台机器访问时必须保持默认
+SHARED_WAL = os.environ.get("TRAVEL_SHARED_WAL") == "1"
+POLL_MS = 3000  # 共用时每隔多久拉取一次别人的修改
 SUMMARY_KEY = "📋 [累计补贴汇总 - 置顶]" 
+# 启动计时模式：python 出差计算器.py --startup-time（或设置环境变量 TRAVEL_STARTUP_TIME=1）
+# 记录窗口出现、记录加载完成、可操作三个时间点，追加到 startup_times.csv 后自动退出
+STARTUP_TIMING = "--startup-time" in sys.argv or bool(os.environ.get("TRAVEL_STARTUP_TIME"))
+STARTUP_LOG = os.path.join(os.path.dirname(CONFIG_FILE), "startup_times.csv")
+SUM_FIELDS = ("total", "cost", "rem_mon")  # 汇总时累加的金额
+
+def cache_key(cfg):
+    # 只取参与计算的字段，名称变更、住宿补贴标准等不影响结果的字段不算在内
+    from travel_engine import INPUT_FIELDS
+    return tuple(str(cfg.get(k)) for k in INPUT_FIELDS)
 
 class TravelCalculator:
     def __init__(self, root):
         self.root = root
         self.root.title("出差补贴计算器 v6 [2026.01版 by Liv]")
         self.root.geometry("620x600") 
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
         
-        self.all_data = self.load_all_config()
+        # 单条修改只追加日志，退出或日志过长时才合并成完整的 json
+        self.store = self.open_store()
+        # 先把窗口显示出来，记录在后台线程里读取；读完之前新增/删除/保存都不可用
+        self.all_data = {}
+        self.loaded = False
+        self.load_result = None
+        self.load_error = None  # 读取失败时的异常；此时 all_data 不是完整记录，退出时不能拿它覆盖快照
+        self.startup_marks = {}
         self.current_project_name = None
+        self.editing_version = None  # 编辑框里项目读入时的版本号，保存时据此判断别人是否改过
+        # 汇总用的逐项目结果缓存：{项目名: (配置指纹, 结果)}，跨天整体失效
+        self.result_cache = {}
+        self.cache_date = None
+        self.name_index = PrefixIndex([])
+        self.running = None  # 当前勾选项目的累计值，勾选/取消时增量更新
 
         self.setup_ui()
-        self.refresh_project_list()
-
-    def load_all_config(self):
+        self.project_list.set_items(["正在加载…"], colors={"正在加载…": "gray"})
+        self.root.after(0, self.mark_startup, "window_ms")
+        threading.Thread(target=self.load_in_background, daemon=True).start()
+        self.root.after(20, self.poll_load)
+
+    def open_store(self):
+        if SHARED_DB:
+            try:
+                return SharedStore(SHARED_DB, wal=SHARED_WAL)
+            except sqlite3.Error as e:
+                messagebox.showwarning("提示", f"共享记录库打不开，改用本机记录：\n{SHARED_DB}\n{e}")
+        return JournalStore(CONFIG_FILE)
+
+    def load_in_background(self):
+        # 只做文件读取和解析，不碰 Tk 控件；顺便预先导入计算引擎（numpy 导入较慢）
+        # 任何异常都要留下结果，否则 poll_load 会一直等（共享库被锁、共享盘断开时抛的是 sqlite3.Error）
         try:
-            with open(CONFIG_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                if SUMMARY_KEY in data: del data[SUMMARY_KEY]
-                return data if data else {"默认项目": self.get_default_values()}
-        except:
-            return {"默认项目": self.get_default_values()}
+            self.load_result = self.store.load()
+        except Exception as e:
+            self.load_error = e
+            self.load_result = {}
+        import travel_engine  # noqa: F401
+
+    def poll_load(self):
+        if self.load_result is None:
+            self.root.after(20, self.poll_load)
+            return
+        self.all_data = self.load_all_config(self.load_result)
+        self.loaded = True
+        self.mark_startup("loaded_ms")
+        self.refresh_project_list()
+        self.root.after_idle(self.mark_startup, "ready_ms")
+        if self.load_error is not None:
+            backup = getattr(self.store, "backup_path", None)
+            messagebox.showerror("错误", f"记录读取失败：{self.load_error}\n"
+                                 + (f"损坏的记录文件已备份到：{backup}\n" if backup else "")
+                                 + "本次新增/修改照常保存，原有记录不会被覆盖。")
+        if isinstance(self.store, SharedStore):
+            self.root.after(POLL_MS, self.poll_remote)
+
+    def poll_remote(self):
+        # 只重新载入别人改过的项目
+        changed = self.store.poll_changes()
+        if changed:
+            for name in changed:
+                self.result_cache.pop(name, None)
+            self.refresh_project_list()
+            if self.current_project_name == SUMMARY_KEY:
+                self.show_summary_view()
+        self.root.after(POLL_MS, self.poll_remote)
+
+    def on_conflict(self, e):
+        # 保存/删除时发现别人先改了：store 已换成库里的最新内容，重新显示给用户确认
+        self.result_cache.pop(e.name, None)
+        if e.name == self.current_project_name and e.name not in self.all_data:
+            self.editing_version = None  # 别人已删除：再保存就按新项目写入
+        self.refresh_project_list()
+        messagebox.showwarning("冲突", f"{e}\n已载入最新内容，请确认后重新操作。")
+        if e.name in self.all_data:
+            self.load_project_data(e.name)
+
+    def mark_startup(self, key):
+        self.startup_marks[key] = (time.perf_counter() - STARTUP_T0) * 1000
+        if STARTUP_TIMING and key == "ready_ms":
+            self.write_startup_log()
+            self.root.destroy()
+
+    def write_startup_log(self):
+        marks = self.startup_marks
+        line = (f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')},{marks.get('window_ms', 0):.1f},"
+                f"{marks.get('loaded_ms', 0):.1f},{marks['ready_ms']:.1f},{len(self.all_data)}\n")
+        new_file = not os.path.exists(STARTUP_LOG)
+        with open(STARTUP_LOG, "a", encoding="utf-8") as f:
+            if new_file:
+                f.write("time,window_ms,loaded_ms,ready_ms,projects\n")
+            f.write(line)
+        print(f"启动耗时：窗口 {marks.get('window_ms', 0):.0f} ms | 记录 {marks.get('loaded_ms', 0):.0f} ms | "
+              f"可操作 {marks['ready_ms']:.0f} ms（{len(self.all_data)} 个项目），已记录到 {STARTUP_LOG}")
+
+    def load_all_config(self, data):
+        if SUMMARY_KEY in data: del data[SUMMARY_KEY]
+        if not data: data["默认项目"] = self.get_default_values()
+        # store 与界面共用同一个字典，store 的增删改会直接反映到 all_data
+        self.store.data = data
+        return data
 
     def get_default_values(self):
         today_str = datetime.today().strftime("%Y-%m-%d")
@@ -55,9 +167,21 @@ class TravelCalculator:
         }
 
     def save_all_config(self):
+        # 完整重写一次 json（合并日志），只在退出时调用
         save_data = {k: v for k, v in self.all_data.items() if k != SUMMARY_KEY}
-        with open(CONFIG_FILE, "w", encoding="utf-8") as f:
-            json.dump(save_data, f, ensure_ascii=False, indent=4)
+        self.store.compact(save_data)
+        self.all_data = save_data
+
+    def on_close(self):
+        # 还没读完、读取失败时不能用不完整的数据覆盖快照；日志里没有新操作也不必重写
+        skip = (not self.loaded or self.load_error is not None
+                or (isinstance(self.store, JournalStore) and not self.store.pending))
+        if not skip:
+            try:
+                self.save_all_config()
+            except OSError:
+                pass  # 合并失败不影响数据，日志仍在，下次启动会重放
+        self.root.destroy()
 
     def add_row(self, parent, label1, label2):
         row = tk.Frame(parent)
@@ -78,9 +202,12 @@ class TravelCalculator:
         self.paned.add(left_frame)
 
         tk.Label(left_frame, text="项目列表", bg="#f0f0f0", font=("微软雅黑", 9, "bold")).pack(pady=5)
-        self.listbox = tk.Listbox(left_frame, font=("微软雅黑", 9))
-        self.listbox.pack(fill="both", expand=True, padx=5, pady=5)
-        self.listbox.bind("<<ListboxSelect>>", self.on_project_select)
+        # 搜索框：按项目名前缀过滤
+        self.search_var = tk.StringVar()
+        self.search_var.trace_add("write", lambda *args: self.apply_filter())
+        tk.Entry(left_frame, textvariable=self.search_var, font=("微软雅黑", 9)).pack(fill="x", padx=5)
+        self.project_list = VirtualList(left_frame, on_select=self.on_project_select)
+        self.project_list.pack(fill="both", expand=True, padx=5, pady=5)
 
         btn_f = tk.Frame(left_frame, bg="#f0f0f0")
         btn_f.pack(fill="x", pady=5)
@@ -116,60 +243,100 @@ class TravelCalculator:
         tk.Button(btn_row, text="💾 保存当前设置", command=self.save_current_settings).pack(side="left", padx=20, expand=True)
         tk.Button(btn_row, text="🧮 开始计算", command=self.calculate, bg="#e1f5fe").pack(side="left", padx=20, expand=True)
 
-        self.summary_frame = tk.Frame(self.right_container)
-        tk.Label(self.summary_frame, text="选择需要汇总的项目", font=("微软雅黑", 9, "bold")).pack(pady=5)
-        
-        self.check_canvas = tk.Canvas(self.summary_frame, height=120)
-        self.check_scroll = ttk.Scrollbar(self.summary_frame, orient="vertical", command=self.check_canvas.yview)
-        self.check_inner = tk.Frame(self.check_canvas)
-        
-        self.check_canvas.create_window((0, 0), window=self.check_inner, anchor="nw")
-        self.check_canvas.configure(yscrollcommand=self.check_scroll.set)
-        self.check_canvas.pack(side="left", fill="both", expand=True)
-        self.check_scroll.pack(side="right", fill="y")
-        
-        tk.Button(self.summary_frame, text="确定", command=self.calculate_all_selected, bg="#d1ffcf", height=2).pack(fill="x", pady=10)
+        self.summary_frame = None  # 汇总页第一次打开时再创建
 
         self.text_result = tk.Text(self.right_container, height=10, font=("微软雅黑", 9), bg="#fafafa")
         self.text_result.pack(fill="both", expand=True)
 
+    def build_summary_frame(self):
+        self.summary_frame = tk.Frame(self.right_container)
+        tk.Label(self.summary_frame, text="选择需要汇总的项目", font=("微软雅黑", 9, "bold")).pack(pady=5)
+        self.label_running = tk.Label(self.summary_frame, text="", fg="green", font=("微软雅黑", 9))
+        self.label_running.pack()
+
+        self.check_list = VirtualList(self.summary_frame, checkable=True, on_toggle=self.on_check_toggle)
+        self.check_list.canvas.config(height=120)
+        self.check_list.pack(fill="both", expand=True)
+
+        tk.Button(self.summary_frame, text="确定", command=self.calculate_all_selected, bg="#d1ffcf", height=2).pack(fill="x", pady=10)
+
     def refresh_project_list(self):
-        self.listbox.delete(0, tk.END)
-        self.listbox.insert(0, SUMMARY_KEY)
-        self.listbox.itemconfig(0, fg="green")
-        for name in sorted(self.all_data.keys()):
-            self.listbox.insert(tk.END, name)
-
-    def on_project_select(self, event):
-        selection = self.listbox.curselection()
-        if not selection: return
-        name = self.listbox.get(selection[0])
+        # 项目有增删改名时重建前缀索引；平时搜索只在索引上二分
+        self.name_index = PrefixIndex(self.all_data.keys())
+        self.apply_filter()
+
+    def apply_filter(self):
+        names = self.name_index.search(self.search_var.get().strip())
+        self.project_list.set_items([SUMMARY_KEY] + names, colors={SUMMARY_KEY: "green"})
+
+    def on_project_select(self, name):
+        if not self.loaded: return
         if name == SUMMARY_KEY:
             self.show_summary_view()
         else:
             self.show_edit_view(name)
 
     def show_edit_view(self, name):
-        self.summary_frame.pack_forget()
+        if self.summary_frame: self.summary_frame.pack_forget()
         self.edit_frame.pack(fill="x")
         self.load_project_data(name)
 
     def show_summary_view(self):
         self.edit_frame.pack_forget()
+        if self.summary_frame is None: self.build_summary_frame()
         self.summary_frame.pack(fill="x")
         self.current_project_name = SUMMARY_KEY
-        for widget in self.check_inner.winfo_children(): widget.destroy()
-        self.check_vars = {}
-        for name in sorted(self.all_data.keys()):
-            var = tk.BooleanVar(value=True)
-            cb = tk.Checkbutton(self.check_inner, text=name, variable=var, font=("微软雅黑", 9))
-            cb.pack(anchor="w")
-            self.check_vars[name] = var
-        self.check_inner.update_idletasks()
-        self.check_canvas.config(scrollregion=self.check_canvas.bbox("all"))
+        names = self.name_index.search("")
+        if names != self.check_list.items:
+            self.check_list.set_items(names)
+        self.check_list.set_checked(names)
+        self.reset_running()
+
+    def cached_results(self, names):
+        # 取若干项目的结果：配置没变且还是同一天的直接用缓存，其余合成一批计算
+        today = date.today()
+        if today != self.cache_date:
+            self.result_cache.clear()
+            self.cache_date = today
+        keys = {name: cache_key(self.all_data[name]) for name in names}
+        todo = [name for name in names if self.result_cache.get(name, (None,))[0] != keys[name]]
+        if todo:
+            from travel_engine import calculate_batch
+            res = calculate_batch([self.all_data[name] for name in todo])
+            for i, name in enumerate(todo):
+                row = {k: res[k][i].item() for k in ("diff", "total_cost_net") + SUM_FIELDS} if res['valid'][i] else None
+                self.result_cache[name] = (keys[name], row)
+        return {name: self.result_cache[name][1] for name in names}
+
+    def reset_running(self):
+        names = self.check_list.checked_items()
+        self.running = {"count": 0, "day": date.today(), **dict.fromkeys(SUM_FIELDS, 0.0)}
+        for row in self.cached_results(names).values():
+            self.add_running(row, 1)
+        self.show_running()
+
+    def add_running(self, row, sign):
+        if row is None: return
+        self.running["count"] += sign
+        for k in SUM_FIELDS:
+            self.running[k] += sign * row[k]
+
+    def on_check_toggle(self, name, checked):
+        if self.running is None or self.running["day"] != date.today():
+            self.reset_running()  # 跨天后结果都变了，整体重算
+            return
+        row = self.cached_results([name])[name]
+        self.add_running(row, 1 if checked else -1)
+        self.show_running()
+
+    def show_running(self):
+        r = self.running
+        self.label_running.config(
+            text=f"已选 {r['count']} 个 | 累计总补贴 {r['total']:.2f} 元 | 净补贴 {r['total'] - r['cost']:.2f} 元")
 
     def load_project_data(self, name):
         self.current_project_name = name
+        self.editing_version = self.store.version(name)
         cfg = self.all_data[name]
         self.entry_proj_name.delete(0, tk.END)
         self.entry_proj_name.insert(0, name)
@@ -186,27 +353,32 @@ class TravelCalculator:
         self.house_choice.set(cfg.get("house_type", 1))
 
     def add_new_project(self):
+        if not self.loaded: return
         new_name = f"新项目_{datetime.now().strftime('%m%d%H%M')}"
         self.all_data[new_name] = self.get_default_values()
         self.refresh_project_list()
         self.load_project_data(new_name)
 
     def delete_project(self):
+        if not self.loaded: return
         if not self.current_project_name or self.current_project_name == SUMMARY_KEY: 
             messagebox.showwarning("警告", "汇总项不可删除！")
             return
         if messagebox.askyesno("提示", f"确定删除项目：{self.current_project_name}？"):
-            del self.all_data[self.current_project_name]
+            try:
+                self.store.delete(self.current_project_name, expected=self.editing_version)
+            except ConflictError as e:
+                self.on_conflict(e)
+                return
+            self.result_cache.pop(self.current_project_name, None)
             self.current_project_name = None
             self.refresh_project_list()
-            self.save_all_config()
 
     def save_current_settings(self):
+        if not self.loaded: return
         name = self.entry_proj_name.get().strip()
         if not name or name == SUMMARY_KEY: return
-        if self.current_project_name and self.current_project_name != name and self.current_project_name != SUMMARY_KEY:
-            if self.current_project_name in self.all_data: del self.all_data[self.current_project_name]
-        self.all_data[name] = {
+        cfg = {
             "start_date": self.entry_start.get().strip(),
             "end_date": self.entry_end.get().strip(),
             "traffic": self.entry_traffic.get().strip(),
@@ -219,56 +391,26 @@ class TravelCalculator:
             "special_money": self.entry_special_money.get().strip(),
             "house_type": self.house_choice.get()
         }
+        old = self.current_project_name
+        self.result_cache.pop(old, None)
+        self.result_cache.pop(name, None)
+        try:
+            if old and old != name and old != SUMMARY_KEY and old in self.all_data:
+                self.store.rename(old, name, cfg, expected=self.editing_version)
+            else:
+                expected = self.editing_version if name == old else self.store.version(name)
+                self.store.put(name, cfg, expected=expected)
+        except ConflictError as e:
+            self.on_conflict(e)
+            return
         self.current_project_name = name
-        self.save_all_config()
+        self.editing_version = self.store.version(name)
         self.refresh_project_list()
         messagebox.showinfo("提示", "设置保存成功！")
 
-    def safe_float(self, val):
-        try: return float(val) if val else 0.0
-        except: return 0.0
-
     def calculate_logic(self, cfg):
-        try:
-            raw_start = cfg['start_date'].replace('.', '-').replace('/', '-').strip()
-            raw_end = cfg['end_date'].replace('.', '-').replace('/', '-').strip()
-            start_date = datetime.strptime(raw_start, "%Y-%m-%d")
-            end_date = datetime.strptime(raw_end, "%Y-%m-%d")
-            today = datetime.today()
-
-            traffic_food = self.safe_float(cfg['traffic'])
-            house_fixed = self.safe_float(cfg['house_fixed'])
-            house_invoice = self.safe_float(cfg['house_invoice'])
-            other = self.safe_float(cfg['other'])
-            cost_day = self.safe_float(cfg['cost_day'])
-            special_money = self.safe_float(cfg['special_money'])
-            special_days = int(self.safe_float(cfg['special_days']))
-            house_type = int(cfg['house_type'])
-
-            house = house_fixed if house_type == 1 else house_invoice
-
-            all_days = (end_date - start_date).days + 1
-            if today > end_date:
-                days_diff = all_days
-                remain_days = 0
-            else:
-                days_diff = (today - start_date).days + 1
-                remain_days = max(0, (end_date - today).days) 
-
-            progress = 100 * (days_diff / all_days) if all_days > 0 else 0
-
-            total_money = (traffic_food + house + other) * (days_diff - special_days) + special_days * (special_money+traffic_food+other)
-            total_money_cost = (traffic_food + house + other - cost_day) * (days_diff - special_days) + special_days * (special_money+traffic_food+other-cost_day)
-            total_cost = days_diff * cost_day
-            remain_money = remain_days * (traffic_food + house + other)
-
-            return {
-                "start": start_date, "end": end_date, "all": all_days, "diff": days_diff, 
-                "remain": remain_days, "prog": progress, "total": total_money, 
-                "total_cost_net": total_money_cost, "cost": total_cost, "rem_mon": remain_money
-            }
-        except:
-            return None
+        from travel_engine import calculate_one
+        return calculate_one(cfg)
 
     def calculate(self):
         cfg = {
@@ -300,22 +442,17 @@ class TravelCalculator:
             messagebox.showerror("错误", "日期格式不正确")
 
     def calculate_all_selected(self):
-        total_sum = 0
-        cost_sum = 0
-        remain_sum = 0
-        count = 0
-        detail_msg = "" 
-
-        for name, var in self.check_vars.items():
-            if var.get():
-                res = self.calculate_logic(self.all_data[name])
-                if res:
-                    total_sum += res['total']
-                    cost_sum += res['cost']
-                    remain_sum += res['rem_mon']
-                    detail_msg += f"· {name[:12]}... : 已计 {res['diff']}天 | 净补贴 {res['total_cost_net']:.2f}元\n"
-                    count += 1
-        
+        names = self.check_list.checked_items()
+        rows = {name: row for name, row in self.cached_results(names).items() if row is not None}
+        count = len(rows)
+        total_sum = sum(row['total'] for row in rows.values())
+        cost_sum = sum(row['cost'] for row in rows.values())
+        remain_sum = sum(row['rem_mon'] for row in rows.values())
+        detail_msg = "".join(
+            f"· {name[:12]}... : 已计 {row['diff']}天 | 净补贴 {row['total_cost_net']:.2f}元\n"
+            for name, row in rows.items()
+        )
+
         if count == 0:
             messagebox.showwarning("提示", "请先勾选要汇总的项目")
             return
@@ -0,0 +1,67 @@
+import re
+
+# ================= 文本替换引擎 =================
+# 规则文件里的 old=new 一律按普通文字匹配（不再当正则，"." "(" 之类不会被误解）。
+# 所有规则事先编译成一个正则，对每段文本只扫描一遍：
+#   · 从左往右找，同一位置能匹配多条规则时取最长的那条（如同时有「1号」「1号机」，遇到「1号机」按后者替换）
+#   · 替换后的文字不会再被其他规则处理（旧做法逐条替换，前一条的结果会被后一条再改）
+# 几千条规则时，正则按公共前缀组织成字典树，匹配时每个位置只沿树走一条路，不必逐条尝试。
+# 字典树转正则不用递归，规则再长也不会超出递归深度；「1」「11」「111」…这类层层互为前缀的规则
+# 会让正则嵌套过深编译不了，此时退回按长度从长到短排列的普通多选正则，匹配结果相同，只是慢一些。
+
+_END = ""
+
+
+def build_trie(keys):
+    trie = {}
+    for key in keys:
+        node = trie
+        for ch in key:
+            node = node.setdefault(ch, {})
+        node[_END] = True
+    return trie
+
+
+def trie_regex(root):
+    # 后序遍历（显式栈）：子节点的正则都拼好了再拼父节点
+    done = {}
+    stack = [(root, False)]
+    while stack:
+        node, ready = stack.pop()
+        if not ready:
+            stack.append((node, True))
+            stack.extend((child, False) for ch, child in node.items() if ch != _END)
+            continue
+        alts = [re.escape(ch) + done.pop(id(child)) for ch, child in sorted(node.items()) if ch != _END]
+        if not alts:
+            body = ""
+        else:
+            body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+            if _END in node:
+                body = "(?:" + body + ")?"  # 这里已是一条完整规则；贪婪的 ? 优先尝试更长的
+        done[id(node)] = body
+    return done[id(root)]
+
+
+def compile_rules(keys):
+    try:
+        return re.compile(trie_regex(build_trie(keys)))
+    except (RecursionError, OverflowError, re.error):
+        # 同一位置先试长的，与字典树一样取最长匹配
+        return re.compile("|".join(re.escape(k) for k in sorted(keys, key=len, reverse=True)))
+
+
+class Replacer:
+    def __init__(self, rules):
+        self.rules = {old: new for old, new in rules.items() if old}
+        self.pattern = compile_rules(self.rules) if self.rules else None
+
+    def replace(self, text):
+        if self.pattern is None:
+            return text
+        return self.pattern.sub(lambda m: self.rules[m.group(0)], text)
+
+    def apply(self, series):
+        # 对一列文本替换；点表里重复文本很多，每个不同的值只替换一次；空值（NaN）原样保留
+        mapping = {text: self.replace(text) if isinstance(text, str) else text for text in series.unique()}
+        return series.map(mapping)
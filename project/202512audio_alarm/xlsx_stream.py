@@ -0,0 +1,164 @@
+import posixpath
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+
+# ================= 流式读取 xlsx：只取「某列字体为红色」的行 =================
+# xlsx 是 zip 包：直接解析当前工作表的 XML 和样式表，边读边丢，不建整本工作簿，
+# 也不用再让 pandas 把同一个文件读第二遍。
+# 与 openpyxl 的取值一致：共享字符串/行内字符串为文字，数字按有无小数点转 int/float，布尔为 bool，
+# 空单元格为 None；日期格式的单元格不做转换（返回 Excel 序列号），点表里用不到。
+# 颜色判断与原来相同：只认字体里直接写的 rgb，主题色/索引色不算。
+
+_CELL_REF = re.compile(r"([A-Z]+)(\d*)")
+
+
+def local(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def column_index(ref):
+    # "D12" → 3
+    letters = _CELL_REF.match(ref).group(1)
+    n = 0
+    for ch in letters:
+        n = n * 26 + ord(ch) - 64
+    return n - 1
+
+
+def active_sheet_path(zf):
+    # 与 openpyxl 的 wb.active 相同：workbook.xml 里 activeTab 指向的那张表
+    wb = ET.fromstring(zf.read("xl/workbook.xml"))
+    active = 0
+    sheets = []
+    for el in wb.iter():
+        tag = local(el.tag)
+        if tag == "workbookView":
+            active = int(el.get("activeTab", 0))
+        elif tag == "sheet":
+            rid = next(v for k, v in el.attrib.items() if local(k) == "id")
+            sheets.append(rid)
+    rels = ET.fromstring(zf.read("xl/_rels/workbook.xml.rels"))
+    targets = {el.get("Id"): el.get("Target") for el in rels.iter() if local(el.tag) == "Relationship"}
+    target = targets[sheets[min(active, len(sheets) - 1)]]
+    return target.lstrip("/") if target.startswith("/") else posixpath.normpath(posixpath.join("xl", target))
+
+
+def red_styles(zf, color):
+    # 样式表里字体颜色为 color 的单元格格式（xf）序号
+    if "xl/styles.xml" not in zf.namelist():
+        return set()
+    styles = ET.fromstring(zf.read("xl/styles.xml"))
+    red_fonts = set()
+    xfs = []
+    for section in styles:
+        tag = local(section.tag)
+        if tag == "fonts":
+            for i, font in enumerate(section):
+                for el in font:
+                    rgb = el.get("rgb")
+                    if local(el.tag) == "color" and rgb and rgb[-6:].upper() == color:
+                        red_fonts.add(i)
+        elif tag == "cellXfs":
+            xfs = [int(xf.get("fontId", 0)) for xf in section]
+    return {i for i, font_id in enumerate(xfs) if font_id in red_fonts}
+
+
+def cell_value(kind, text):
+    # 共享字符串先记下序号，读完工作表再统一换成文字
+    if text is None:
+        return None
+    if kind == "s":
+        return _SharedRef(int(text))
+    if kind in ("str", "inlineStr", "e", "d"):
+        return text
+    if kind == "b":
+        return text == "1"
+    if "." in text or "E" in text or "e" in text:
+        return float(text)
+    return int(text)
+
+
+class _SharedRef(int):
+    pass
+
+
+def shared_strings(zf, wanted):
+    # 只取用到的共享字符串；富文本把各段拼起来，注音（rPh）不要
+    if not wanted or "xl/sharedStrings.xml" not in zf.namelist():
+        return {}
+    found = {}
+    index = 0
+    with zf.open("xl/sharedStrings.xml") as f:
+        for event, el in ET.iterparse(f, events=("end",)):
+            if local(el.tag) != "si":
+                continue
+            if index in wanted:
+                parts = []
+                for child in el:
+                    tag = local(child.tag)
+                    if tag == "t":
+                        parts.append(child.text or "")
+                    elif tag == "r":
+                        parts.extend(t.text or "" for t in child if local(t.tag) == "t")
+                found[index] = "".join(parts)
+            index += 1
+            el.clear()
+    return found
+
+
+def read_red_rows(path, key_column="名称", color="FF0000"):
+    # 返回 (表头, [第2行起 key_column 字体为 color 的各行的值列表])，按表中顺序；缺 key_column 时抛 ValueError
+    # 表头可能是共享字符串，读到最后才知道哪一列是 key_column，所以扫描时先留下「有红字单元格」的行
+    # 及其红字所在列，读完再按 key_column 筛一遍；内存只与红字行数有关
+    color = color.upper()
+    with zipfile.ZipFile(path) as zf:
+        sheet = active_sheet_path(zf)
+        red = red_styles(zf, color)
+        headers = None
+        candidates = []  # [(各列的值, 红字所在列)]
+        with zf.open(sheet) as f:
+            for event, el in ET.iterparse(f, events=("end",)):
+                if local(el.tag) != "row":
+                    continue
+                cells = {}
+                red_cols = set()
+                pos = 0
+                for c in el:
+                    if local(c.tag) != "c":
+                        continue
+                    ref = c.get("r")
+                    pos = column_index(ref) if ref else pos
+                    kind = c.get("t", "n")
+                    if kind == "inlineStr":
+                        parts = [t.text or "" for t in c.iter() if local(t.tag) == "t"]
+                        text = "".join(parts) if parts else None
+                    else:
+                        v = next((x for x in c if local(x.tag) == "v"), None)
+                        text = v.text if v is not None else None
+                    cells[pos] = cell_value(kind, text)
+                    if int(c.get("s", 0)) in red:
+                        red_cols.add(pos)
+                    pos += 1
+                el.clear()
+                if headers is None:
+                    headers = cells
+                elif red_cols:
+                    candidates.append((cells, red_cols))
+
+        headers = headers or {}
+        wanted = {v for cells in [headers] + [c for c, _ in candidates] for v in cells.values()
+                  if isinstance(v, _SharedRef)}
+        strings = shared_strings(zf, wanted)
+
+    width = max(headers) + 1 if headers else 0
+    header_list = [resolve(headers.get(i), strings) for i in range(width)]
+    if key_column not in header_list:
+        raise ValueError(f"Excel 缺少列：{key_column}")
+    key_idx = header_list.index(key_column)
+    return header_list, [[resolve(cells.get(i), strings) for i in range(width)]
+                         for cells, red_cols in candidates if key_idx in red_cols]
+
+
+def resolve(value, strings):
+    return strings.get(value, "") if isinstance(value, _SharedRef) else value
@@ -1,9 +1,11 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox
 import pandas as pd
-import openpyxl
 import os
 
+from replace_engine import Replacer
+from xlsx_stream import read_red_rows
+
 
 # ================= 规则加载 =================
 
@@ -27,29 +29,14 @@ def process_excel(input_path, output_path, rule_file, gui_prefix):
     # ---------- 加载替换规则 ----------
     replace_rules = load_replace_rules(rule_file)
 
-    # ---------- 1. 用 openpyxl 找「名称列标红的行」 ----------
-    wb = openpyxl.load_workbook(input_path)
-    ws = wb.active
-
-    red_rows = []
-    for row in ws.iter_rows(min_row=2):  # 跳过表头
-        cell = row[3]  # 第4列：名称
-        font_color = cell.font.color
-        if font_color and font_color.type == "rgb":
-            rgb = font_color.rgb
-            if rgb:
-                rgb_str = rgb if isinstance(rgb, str) else rgb.rgb
-                if rgb_str[-6:].upper() == "FF0000":
-                    red_rows.append(cell.row)
+    # ---------- 1. 流式读取「名称列标红的行」（只读一遍文件，不建整本工作簿） ----------
+    headers, red_rows = read_red_rows(input_path, key_column="名称")
 
     if not red_rows:
         raise ValueError("未找到任何「名称列为红色」的行")
 
-    # ---------- 2. pandas 只保留这些行 ----------
-    df = pd.read_excel(input_path)
-
-    rows_idx = sorted(set(r - 2 for r in red_rows))  # Excel 行号 → df 行号
-    df = df.iloc[rows_idx].reset_index(drop=True)
+    # ---------- 2. 只用这些行建表 ----------
+    df = pd.DataFrame(red_rows, columns=headers)
 
     # ---------- 必须列检查 ----------
     required_cols = {"序号", "前缀", "描述", "名称"}
@@ -65,8 +52,8 @@ def process_excel(input_path, output_path, rule_file, gui_prefix):
 
     # ---------- 4. 对整段文本做规则替换 ----------
     df["最终文本"] = (
-        df["原始文本"]
-        .replace(replace_rules, regex=True)
+        Replacer(replace_rules)
+        .apply(df["原始文本"])
     )
 
     # ---------- 5. 描述加 .wav ----------
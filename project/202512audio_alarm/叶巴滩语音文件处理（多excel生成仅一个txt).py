@@ -1,8 +1,25 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox
 import pandas as pd
-import openpyxl
 import os
+import json
+import time
+import hashlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from replace_engine import Replacer
+from xlsx_stream import read_red_rows
+
+# ---------- 配置区域 ----------
+worker_count = os.cpu_count() or 1  # 多个 Excel 时并行处理的进程数，设为 1 则逐个处理
+parallel_min_files = 4              # 少于这么多个 Excel 时逐个处理（启动进程本身要一两秒）
+max_in_flight = worker_count * 2    # 同时在途（已提交未写出）的 Excel 数上限，用来封顶内存占用
+# 结果缓存：Excel、规则文件、前缀都没变时直接用上次的结果，不再打开 Excel；留空则不缓存
+cache_dir = os.path.join(os.environ.get("LOCALAPPDATA", os.path.expanduser("~")), "VoiceTxtCache")
+cache_max_age_days = 30             # 超过这么多天没用到的缓存自动清掉
+CACHE_VERSION = "1"                 # 提取/替换逻辑有变化时改这里，旧缓存随之全部失效
+# -------------------------------
 
 
 # ================= 规则加载 =================
@@ -23,10 +40,12 @@ def load_replace_rules(rule_file):
 # ================= 核心处理（单个 Excel → DataFrame） =================
 
 def process_excel_all_in_one(input_excel, rule_file, gui_prefix):
-    wb = openpyxl.load_workbook(input_excel)
-    ws = wb.active
+    replacer = Replacer(load_replace_rules(rule_file))
+    return extract_rows(input_excel, replacer, gui_prefix)
 
-    headers = [cell.value for cell in ws[1]]
+
+def extract_rows(input_excel, replacer, gui_prefix):
+    headers, valid_rows = read_red_rows(input_excel, key_column="名称")
 
     def col_index(name):
         if name not in headers:
@@ -37,17 +56,6 @@ def process_excel_all_in_one(input_excel, rule_file, gui_prefix):
     idx_desc = col_index("描述")
     idx_name = col_index("名称")
 
-    valid_rows = []
-
-    for row in ws.iter_rows(min_row=2):
-        name_cell = row[idx_name]
-        font_color = name_cell.font.color
-
-        if font_color and font_color.type == "rgb":
-            rgb = font_color.rgb
-            if rgb and rgb[-6:].upper() == "FF0000":
-                valid_rows.append(row)
-
     if not valid_rows:
         return pd.DataFrame(columns=["序号", "最终文本", "描述_处理后"])
 
@@ -59,24 +67,207 @@ def process_excel_all_in_one(input_excel, rule_file, gui_prefix):
     }
 
     for row in valid_rows:
-        data["序号"].append(row[idx_id].value)
+        data["序号"].append(row[idx_id])
         data["前缀"].append("")
-        data["描述"].append(row[idx_desc].value)
-        data["名称"].append(row[idx_name].value)
+        data["描述"].append(row[idx_desc])
+        data["名称"].append(row[idx_name])
 
     df = pd.DataFrame(data)
 
     df["原始文本"] = gui_prefix + df["前缀"].astype(str) + df["名称"].astype(str)
 
-    replace_rules = load_replace_rules(rule_file)
-
-    df["最终文本"] = df["原始文本"].replace(replace_rules, regex=True)
+    df["最终文本"] = replacer.apply(df["原始文本"])
 
     df["描述_处理后"] = df["描述"].astype(str) + ".wav"
 
     return df[["序号", "最终文本", "描述_处理后"]]
 
 
+# ================= 结果缓存 =================
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ResultCache:
+    # 键为 (Excel 内容哈希, 规则文件哈希, 前缀)，值为该 Excel 提取出的 序号/最终文本/描述_处理后。
+    # Excel 的内容哈希另按 (大小, 修改时间) 记在 index.json：文件没动过时连读都不用读。
+    # pandas 版本也算进键里，换了版本的旧缓存直接不用。缓存出任何问题都只当作没命中，不影响结果
+    def __init__(self, folder, rule_file, gui_prefix):
+        self.folder = folder
+        self.index_path = os.path.join(folder, "index.json")
+        os.makedirs(folder, exist_ok=True)
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                self.index = json.load(f)
+        except (OSError, ValueError):
+            self.index = {}
+        if not isinstance(self.index, dict):
+            self.index = {}
+        self.dirty = False
+        self.salt = f"{CACHE_VERSION}|{pd.__version__}|{file_hash(rule_file)}|{gui_prefix}"
+
+    def key(self, excel):
+        # 读不到文件或 index.json 内容不对时返回 None，该 Excel 本次不走缓存
+        try:
+            path = os.path.abspath(excel)
+            st = os.stat(path)
+            entry = self.index.get(path)
+            if not entry or entry["size"] != st.st_size or entry["mtime"] != st.st_mtime_ns:
+                entry = {"size": st.st_size, "mtime": st.st_mtime_ns, "sha256": file_hash(path)}
+                self.index[path] = entry
+                self.dirty = True
+            return hashlib.sha256(f"{entry['sha256']}|{self.salt}".encode("utf-8")).hexdigest()
+        except (OSError, KeyError, TypeError):
+            return None
+
+    def has(self, key):
+        # 只看缓存文件在不在，不读内容
+        return key is not None and os.path.exists(os.path.join(self.folder, key + ".pkl"))
+
+    def get(self, key):
+        if key is None:
+            return None
+        path = os.path.join(self.folder, key + ".pkl")
+        try:
+            df = pd.read_pickle(path)
+            os.utime(path)  # 记下最近使用时间，清理时按它算
+            return df
+        except Exception:
+            # 文件坏了、或是别的 pandas 版本写的（可能抛出各种异常），都当没命中重新解析
+            return None
+
+    def put(self, key, df):
+        if key is None:
+            return
+        path = os.path.join(self.folder, key + ".pkl")
+        tmp_path = path + ".tmp"
+        try:
+            df.to_pickle(tmp_path)
+            os.replace(tmp_path, path)
+        except Exception:
+            pass  # 缓存写不进去不影响本次结果
+
+    def save(self):
+        # 写回 index.json（已不存在的 Excel 一并去掉），并清理长期没用到的缓存
+        try:
+            if self.dirty:
+                self.index = {p: e for p, e in self.index.items() if os.path.exists(p)}
+                tmp_path = self.index_path + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(self.index, f, ensure_ascii=False)
+                os.replace(tmp_path, self.index_path)
+            expire = time.time() - cache_max_age_days * 86400
+            with os.scandir(self.folder) as it:
+                for entry in it:
+                    if entry.name.endswith(".pkl") and entry.stat().st_mtime < expire:
+                        os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def open_cache(folder, rule_file, gui_prefix):
+    # 缓存目录建不了、规则文件读不了哈希时本次不用缓存
+    try:
+        return ResultCache(folder, rule_file, gui_prefix)
+    except OSError as e:
+        print(f"结果缓存不可用，本次不使用缓存：{e}")
+        return None
+
+
+# ================= 多个 Excel（可多进程） =================
+
+_worker_replacer = None  # 每个工作进程各编译一次规则
+
+
+def init_worker(rules):
+    global _worker_replacer
+    _worker_replacer = Replacer(rules)
+
+
+def worker_extract(input_excel, gui_prefix):
+    return extract_rows(input_excel, _worker_replacer, gui_prefix)
+
+
+def process_all(input_excels, rule_file, gui_prefix, workers=None, cache_folder=None):
+    # 规则文件只读一次；按输入顺序逐个产出 (Excel 路径, 结果)（多进程时也保持顺序）
+    # 缓存命中的直接产出，只有没命中的才解析（多于 parallel_min_files 个时用多进程）；
+    # 多进程时最多 max_in_flight 个在途，先做完的后面的文件排队等前面的产出，不会全部堆在内存里。
+    # 命中与否只看缓存文件在不在，轮到产出时才读入，内存里同样只有在途的几个
+    workers = worker_count if workers is None else workers
+    cache_folder = cache_dir if cache_folder is None else cache_folder
+    rules = load_replace_rules(rule_file)
+    cache = open_cache(cache_folder, rule_file, gui_prefix) if cache_folder else None
+    keys = {excel: cache.key(excel) for excel in input_excels} if cache else {}
+    hits = {excel for excel in input_excels if cache and cache.has(keys[excel])}
+    todo = [excel for excel in input_excels if excel not in hits]
+    workers = min(workers, len(todo))
+    replacer = None
+
+    def extract_here(excel):
+        nonlocal replacer
+        if replacer is None:
+            replacer = Replacer(rules)
+        df = extract_rows(excel, replacer, gui_prefix)
+        if cache:
+            cache.put(keys[excel], df)
+        return df
+
+    def finish(excel, item):
+        # item 为 None 表示缓存命中：此时才读缓存，读不出来（文件坏了）就当场解析
+        if item is None:
+            df = cache.get(keys[excel])
+            return df if df is not None else extract_here(excel)
+        df = item.result()
+        if cache:
+            cache.put(keys[excel], df)
+        return df
+
+    try:
+        if workers > 1 and len(todo) >= parallel_min_files:
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(rules,)) as pool:
+                pending = deque()
+                for excel in input_excels:
+                    if len(pending) >= max(max_in_flight, workers):
+                        yield pending[0][0], finish(*pending.popleft())
+                    pending.append((excel, None if excel in hits else pool.submit(worker_extract, excel, gui_prefix)))
+                while pending:
+                    yield pending[0][0], finish(*pending.popleft())
+        else:
+            for excel in input_excels:
+                yield excel, finish(excel, None) if excel in hits else extract_here(excel)
+    finally:
+        if cache:
+            cache.save()
+
+
+def write_txt(input_excels, rule_file, gui_prefix, output_txt, progress=None):
+    # 每处理完一个 Excel 就追加写入临时文件，全部成功后再改名为 output_txt；
+    # 中途出错删掉临时文件，原有的 output_txt 不受影响。progress(已完成数, 总数, 路径, 行数) 每个文件回调一次
+    tmp_txt = output_txt + ".tmp"
+    total = 0
+    try:
+        with open(tmp_txt, "w", encoding="utf-8", newline="") as f:
+            for i, (excel, df) in enumerate(process_all(input_excels, rule_file, gui_prefix), 1):
+                if not df.empty:
+                    df.to_csv(f, sep=" ", index=False, header=False)
+                    total += len(df)
+                if progress:
+                    progress(i, len(input_excels), excel, len(df))
+        if total == 0:
+            raise ValueError("所有 Excel 中均未找到有效数据")
+        os.replace(tmp_txt, output_txt)
+    except BaseException:
+        if os.path.exists(tmp_txt):
+            os.remove(tmp_txt)
+        raise
+    return total
+
+
 # ================= GUI 行为 =================
 
 def choose_input():
@@ -135,31 +326,13 @@ def run():
     output_txt = os.path.join(output_dir, output_name)
 
     try:
-        all_dfs = []
-
-        for excel in input_excels:
-            df = process_excel_all_in_one(
-                input_excel=excel,
-                rule_file=rule_file,
-                gui_prefix=gui_prefix
-            )
-            if not df.empty:
-                all_dfs.append(df)
-
-        if not all_dfs:
-            raise ValueError("所有 Excel 中均未找到有效数据")
-
-        final_df = pd.concat(all_dfs, ignore_index=True)
+        def progress(done, count, excel, rows):
+            label_status.config(text=f"已处理 {done}/{count}：{os.path.basename(excel)}（{rows} 行）")
+            root.update_idletasks()
 
-        final_df.to_csv(
-            output_txt,
-            sep=" ",
-            index=False,
-            header=False,
-            encoding="utf-8"
-        )
+        total = write_txt(input_excels, rule_file, gui_prefix, output_txt, progress)
 
-        messagebox.showinfo("完成", f"生成成功：\n{output_txt}")
+        messagebox.showinfo("完成", f"生成成功（共 {total} 行）：\n{output_txt}")
 
     except Exception as e:
         messagebox.showerror("失败", str(e))
@@ -167,47 +340,52 @@ def run():
 
 # ================= 主窗口 =================
 
-root = tk.Tk()
-root.title("Excel → TXT 点表一体化处理工具")
-root.geometry("800x420")
-# root.resizable(False, False)
-
-tk.Label(
-    root,
-    text="输入 Excel：\n（可Ctrl/Shift多选）\n（选中可复制文字）"
-).grid(row=0, column=0, padx=30, pady=12, sticky="ne")
-
-entry_input = tk.Text(root, width=58, height=8)
-entry_input.grid(row=0, column=1)
-
-tk.Button(root, text="选择", command=choose_input).grid(row=0, column=2)
-
-tk.Label(root, text="输出文件夹路径：").grid(row=1, column=0, padx=30, pady=12, sticky="e")
-entry_out_dir = tk.Entry(root, width=58)
-entry_out_dir.grid(row=1, column=1)
-tk.Button(root, text="选择", command=choose_output_dir).grid(row=1, column=2)
-
-tk.Label(root, text="输出文件名称：").grid(row=2, column=0, padx=30, pady=12, sticky="e")
-entry_out_name = tk.Entry(root, width=58)
-entry_out_name.grid(row=2, column=1, sticky="w")
-tk.Label(root, text="（可不写 .txt）").grid(row=2, column=2, sticky="w")
-
-tk.Label(root, text="规则文件：").grid(row=3, column=0, padx=30, pady=12, sticky="e")
-entry_rule = tk.Entry(root, width=40)
-entry_rule.grid(row=3, column=1, sticky="w")
-tk.Button(root, text="选择", command=choose_rule).grid(row=3, column=2)
-
-tk.Label(root, text="前缀（参与替换）").grid(row=4, column=0, padx=30, pady=12, sticky="e")
-tk.Label(root, text="注意：若选多个设备，\n当心设备间前缀不一致").grid(row=4, column=2, padx=30, pady=12, sticky="e")
-entry_prefix = tk.Entry(root, width=58)
-entry_prefix.grid(row=4, column=1, sticky="w")
-
-tk.Button(
-    root,
-    text="开始处理",
-    width=24,
-    height=2,
-    command=run
-).grid(row=5, column=1, pady=10)
-
-root.mainloop()
+# 多进程在 Windows 上会重新导入本文件，窗口只能在主程序里创建
+if __name__ == "__main__":
+    root = tk.Tk()
+    root.title("Excel → TXT 点表一体化处理工具")
+    root.geometry("800x420")
+    # root.resizable(False, False)
+
+    tk.Label(
+        root,
+        text="输入 Excel：\n（可Ctrl/Shift多选）\n（选中可复制文字）"
+    ).grid(row=0, column=0, padx=30, pady=12, sticky="ne")
+
+    entry_input = tk.Text(root, width=58, height=8)
+    entry_input.grid(row=0, column=1)
+
+    tk.Button(root, text="选择", command=choose_input).grid(row=0, column=2)
+
+    tk.Label(root, text="输出文件夹路径：").grid(row=1, column=0, padx=30, pady=12, sticky="e")
+    entry_out_dir = tk.Entry(root, width=58)
+    entry_out_dir.grid(row=1, column=1)
+    tk.Button(root, text="选择", command=choose_output_dir).grid(row=1, column=2)
+
+    tk.Label(root, text="输出文件名称：").grid(row=2, column=0, padx=30, pady=12, sticky="e")
+    entry_out_name = tk.Entry(root, width=58)
+    entry_out_name.grid(row=2, column=1, sticky="w")
+    tk.Label(root, text="（可不写 .txt）").grid(row=2, column=2, sticky="w")
+
+    tk.Label(root, text="规则文件：").grid(row=3, column=0, padx=30, pady=12, sticky="e")
+    entry_rule = tk.Entry(root, width=40)
+    entry_rule.grid(row=3, column=1, sticky="w")
+    tk.Button(root, text="选择", command=choose_rule).grid(row=3, column=2)
+
+    tk.Label(root, text="前缀（参与替换）").grid(row=4, column=0, padx=30, pady=12, sticky="e")
+    tk.Label(root, text="注意：若选多个设备，\n当心设备间前缀不一致").grid(row=4, column=2, padx=30, pady=12, sticky="e")
+    entry_prefix = tk.Entry(root, width=58)
+    entry_prefix.grid(row=4, column=1, sticky="w")
+
+    tk.Button(
+        root,
+        text="开始处理",
+        width=24,
+        height=2,
+        command=run
+    ).grid(row=5, column=1, pady=10)
+
+    label_status = tk.Label(root, text="", fg="gray")
+    label_status.grid(row=6, column=1)
+
+    root.mainloop()
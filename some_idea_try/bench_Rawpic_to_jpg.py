@@ -0,0 +1,119 @@
+import rawpy
+from PIL import Image
+import os
+import io
+import sys
+import time
+import csv
+from concurrent.futures import ProcessPoolExecutor
+
+from many_Rawpic_to_jpg import RAW_EXTS, postprocess_params
+
+# RAW转JPEG基准测试：固定样本集上分工序计时，比较不同进程数与JPEG质量
+# 用法：改好配置区域后在本目录运行 python bench_Rawpic_to_jpg.py
+
+# ---------- 配置区域 ----------
+corpus_folder = r"D:\RAW_bench"     # 样本RAW目录（固定放一批有代表性的文件，各次测试才可比）
+corpus_limit = 40                   # 最多取多少个样本（按路径排序取前 N 个，保证每次是同一批）
+worker_counts = [1, 2, 4, 8, 16]    # 要比较的进程数
+jpeg_qualities = [75, 90, 95]       # 要比较的JPEG质量
+result_csv = "bench_result.csv"     # 结果汇总表，留空则只打印
+# -------------------------------
+
+STAGES = ("open", "postprocess", "fromarray", "save")
+
+
+def load_corpus(folder, limit):
+    paths = []
+    for root, dirs, files in os.walk(folder):
+        for file in files:
+            if file.lower().endswith(RAW_EXTS):
+                paths.append(os.path.join(root, file))
+    return sorted(paths)[:limit]
+
+
+def peak_rss_mb():
+    # 当前进程的峰值常驻内存；Windows 没有 resource 模块，装了 psutil 时用 psutil
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss) / 1024 / 1024
+    except ImportError:
+        return float("nan")
+
+
+def bench_one(raw_path, quality):
+    # 与转换脚本相同的步骤，逐步计时；JPEG 写到内存里，不让磁盘写入干扰编码耗时
+    timing = {}
+    t0 = time.perf_counter()
+    with rawpy.imread(raw_path) as raw:
+        t1 = time.perf_counter()
+        rgb = raw.postprocess(**postprocess_params)
+        t2 = time.perf_counter()
+    img = Image.fromarray(rgb)
+    t3 = time.perf_counter()
+    img.save(io.BytesIO(), 'JPEG', quality=quality)
+    t4 = time.perf_counter()
+    timing["open"], timing["postprocess"] = t1 - t0, t2 - t1
+    timing["fromarray"], timing["save"] = t3 - t2, t4 - t3
+    return timing, os.getpid(), peak_rss_mb()
+
+
+def run_case(corpus, workers, quality):
+    stage_sum = dict.fromkeys(STAGES, 0.0)
+    peaks = {}
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for timing, pid, peak in pool.map(bench_one, corpus, [quality] * len(corpus)):
+            for k in STAGES:
+                stage_sum[k] += timing[k]
+            peaks[pid] = max(peak, peaks.get(pid, 0.0))
+    elapsed = time.perf_counter() - started
+    total_mb = sum(os.path.getsize(p) for p in corpus) / 1024 / 1024
+    return {
+        "workers": workers,
+        "quality": quality,
+        "files": len(corpus),
+        "seconds": round(elapsed, 3),
+        "files_per_sec": round(len(corpus) / elapsed, 3),
+        "mb_per_sec": round(total_mb / elapsed, 2),
+        # 各工序平均每个文件的耗时（秒）
+        **{f"{k}_avg_s": round(stage_sum[k] / len(corpus), 4) for k in STAGES},
+        # 单个工作进程的最大峰值，以及所有工作进程峰值之和（近似整体占用上限）
+        "peak_rss_mb_max": round(max(peaks.values()), 1),
+        "peak_rss_mb_sum": round(sum(peaks.values()), 1),
+    }
+
+
+def print_row(row):
+    print(f"进程 {row['workers']:>2} | 质量 {row['quality']:>3} | {row['files_per_sec']:>7.2f} 个/s | "
+          f"{row['mb_per_sec']:>7.1f} MB/s | "
+          + " ".join(f"{k} {row[k + '_avg_s']:.3f}s" for k in STAGES)
+          + f" | 峰值RSS {row['peak_rss_mb_max']:.0f} MB (合计 {row['peak_rss_mb_sum']:.0f} MB)")
+
+
+if __name__ == "__main__":
+    corpus = load_corpus(corpus_folder, corpus_limit)
+    if not corpus:
+        sys.exit(f"样本目录中没有RAW文件：{corpus_folder}")
+    print(f"样本 {len(corpus)} 个，共 {sum(os.path.getsize(p) for p in corpus) / 1024 / 1024:.0f} MB")
+
+    rows = []
+    for quality in jpeg_qualities:
+        for workers in worker_counts:
+            row = run_case(corpus, workers, quality)
+            print_row(row)
+            rows.append(row)
+
+    if result_csv:
+        with open(result_csv, "w", encoding="utf-8-sig", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"结果已写入：{result_csv}")
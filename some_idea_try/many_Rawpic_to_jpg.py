@@ -1,32 +1,991 @@
 import rawpy
-from PIL import Image
+from PIL import Image, ImageCms
 import os
+import json
+import shutil
+import hashlib
+import io
+import time
+import queue
+import threading
+import itertools
+import csv
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 
 # ---------- 配置区域 ----------
 source_folder = r"D:\RAW_photos"    # 母文件夹，替换成你的RAW根目录
 output_folder = r"D:\JPEG_output"   # 输出根目录
 jpeg_quality = 90                   # JPEG压缩质量
+worker_count = os.cpu_count() or 1  # 并行转换的进程数，设为 1 则逐个转换
+max_in_flight = worker_count * 2    # 同时在途（已提交未完成）的文件数上限，用来封顶内存占用
+engine = "pipeline"                 # "pipeline"：读取/解码/编码分工序流水线；"pool"：每个进程整件转换
+read_threads = 4                    # 流水线预读线程数（NAS 上可适当调大）
+encode_threads = 2                  # 流水线编码写出线程数
+queue_depth = worker_count          # 流水线工序间队列长度
+memory_budget_mb = 0                # 内存上限（MB），>0 时按首个RAW的尺寸估算并收紧并发；0 表示不限制
+timing_log_file = ""                # 非空时逐文件记录各工序耗时（CSV），供生产环境排查慢文件
+# 输出规格：同一次解码生成多种尺寸/格式。max_size 为长边像素上限（0 为原尺寸），suffix 加在文件名后
+# 例：[{"suffix": "", "max_size": 0, "quality": 90, "format": "JPEG"},
+#      {"suffix": "_web", "max_size": 2048, "quality": 85, "format": "JPEG"},
+#      {"suffix": "_thumb", "max_size": 320, "quality": 80, "format": "WEBP"}]
+renditions = [{"suffix": "", "max_size": 0, "quality": jpeg_quality, "format": "JPEG"}]
+postprocess_params = {}             # 传给 raw.postprocess() 的参数，如 {"use_camera_wb": True}
+incremental = True                  # 增量模式：跳过源文件与参数都未变化的RAW
+manifest_file = os.path.join(output_folder, "raw2jpg_manifest.json")  # 增量清单位置
+preview_mode = False                # 预览模式：直接取RAW内嵌缩略图代替完整渲染，用于快速挑片
+preview_fallback = True             # 预览模式下没有内嵌缩略图时，是否退回半尺寸解码
+journal_file = os.path.join(output_folder, "raw2jpg_journal.txt")     # 断点日志：中途崩溃后重跑从断点继续
+failed_list_file = os.path.join(output_folder, "raw2jpg_failed.txt")  # 失败清单：每次运行结束时重写
+retry_failed_only = False           # True 时只重试失败清单里的文件，不再遍历 source_folder
+scan_threads = 8                    # 目录扫描线程数，网络共享盘上可调大
+dir_cache_file = os.path.join(output_folder, "raw2jpg_dircache.json")  # 目录缓存，留空则每次全量列目录
+keep_metadata = True                # 把RAW的EXIF（拍摄时间、机身、镜头等）、方向和sRGB色彩配置写进输出
+index_file = os.path.join(output_folder, "raw2jpg_index.csv")  # 索引表：一行一张图的拍摄信息与输出路径，留空不生成
 # -------------------------------
 
-# 遍历母文件夹及所有子文件夹
-for root, dirs, files in os.walk(source_folder):
-    for file in files:
-        if file.lower().endswith(('.cr2', '.nef', '.arw', '.rw2', '.orf', '.raf')):  # 常见RAW格式
-            raw_path = os.path.join(root, file)
-            # 构建输出路径，保持原目录结构
-            relative_path = os.path.relpath(root, source_folder)
-            output_dir = os.path.join(output_folder, relative_path)
-            os.makedirs(output_dir, exist_ok=True)
-            output_path = os.path.join(output_dir, os.path.splitext(file)[0] + '.jpg')
-            
-            # 读取RAW并保存为JPEG
+RAW_EXTS = ('.cr2', '.nef', '.arw', '.rw2', '.orf', '.raf')  # 常见RAW格式
+# 估算单个文件在途时每像素占用的字节数：
+# LibRaw 原始数据 2 + 四通道16位工作缓冲 8 + RGB输出 3 + 复用的 PIL 缓冲 4，取整留余量
+BYTES_PER_PIXEL = 18
+FORMAT_EXTS = {"JPEG": ".jpg", "WEBP": ".webp", "PNG": ".png"}
+# LibRaw 的 flip 值 → EXIF Orientation（只有内嵌预览图需要，postprocess 出图时已经转正）
+FLIP_TO_ORIENTATION = {0: 1, 3: 3, 5: 8, 6: 6}
+EXIF_IFD, GPS_IFD, MAKER_NOTE = 0x8769, 0x8825, 0x927C
+# 随图写出的 IFD0 标签：Make、Model、DateTime、Software、Artist、Copyright
+IFD0_TAGS = (0x010F, 0x0110, 0x0132, 0x0131, 0x013B, 0x8298)
+# 索引表的列，及其对应的 (IFD, 标签)
+INDEX_TAGS = {
+    "capture_time": (EXIF_IFD, 0x9003),
+    "make": (None, 0x010F),
+    "model": (None, 0x0110),
+    "lens": (EXIF_IFD, 0xA434),
+    "exposure_time": (EXIF_IFD, 0x829A),
+    "f_number": (EXIF_IFD, 0x829D),
+    "iso": (EXIF_IFD, 0x8827),
+    "focal_length": (EXIF_IFD, 0x920A),
+}
+
+_local = threading.local()
+
+
+def iter_raw_tasks(source_folder, output_folder, threads=1, cache_file=""):
+    # 遍历母文件夹及所有子文件夹，逐个给出 (RAW路径, 输出路径)，边扫描边产出
+    for raw_path in scan_raw_files(source_folder, threads, cache_file):
+        yield make_task(raw_path, source_folder, output_folder)
+
+
+class DirCache:
+    # 目录缓存：记录每个目录的 mtime 与其中的RAW文件名、子目录名
+    # 目录 mtime 没变（没有增删改名）就直接用缓存，不再列目录
+    def __init__(self, path):
+        self.path = path
+        self.visited = {}
+        self.lock = threading.Lock()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self.dirs = json.load(f)
+        except (OSError, ValueError):
+            self.dirs = {}
+
+    def list_dir(self, dir_path):
+        mtime = os.stat(dir_path).st_mtime_ns
+        cached = self.dirs.get(dir_path)
+        if cached and cached["mtime"] == mtime:
+            entry = cached
+        else:
+            files, subdirs = list_dir(dir_path)
+            entry = {"mtime": mtime, "files": files, "dirs": subdirs}
+        with self.lock:
+            self.visited[dir_path] = entry
+        return entry["files"], entry["dirs"]
+
+    def save(self):
+        # 只保留本次扫到的目录，已删除的目录随之清掉
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        data = json.dumps(self.visited, ensure_ascii=False).encode("utf-8")
+        atomic_write(self.path, lambda f: f.write(data))
+
+
+def list_dir(dir_path):
+    files, subdirs = [], []
+    with os.scandir(dir_path) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.name)
+            elif entry.name.lower().endswith(RAW_EXTS):
+                files.append(entry.name)
+    return files, subdirs
+
+
+def scan_raw_files(source_folder, threads=1, cache_file=""):
+    # 多线程 os.scandir 扫描：每个目录一个任务，子目录再提交回线程池；
+    # 找到的RAW路径立即放进队列交给调用方，不必等整棵树扫完
+    cache = DirCache(cache_file) if cache_file else None
+    found = queue.Queue()
+    remaining = [0]
+    lock = threading.Lock()
+
+    def submit(dir_path):
+        with lock:
+            remaining[0] += 1
+        pool.submit(scan, dir_path)
+
+    def scan(dir_path):
+        try:
+            files, subdirs = cache.list_dir(dir_path) if cache else list_dir(dir_path)
+            for name in files:
+                found.put(os.path.join(dir_path, name))
+            for name in subdirs:
+                submit(os.path.join(dir_path, name))
+        except OSError as e:
+            print(f"扫描失败: {dir_path}, 错误: {e}")
+        finally:
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    found.put(None)
+
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as pool:
+        submit(source_folder)
+        while True:
+            raw_path = found.get()
+            if raw_path is None:
+                break
+            yield raw_path
+    if cache is not None:
+        cache.save()
+
+
+def make_task(raw_path, source_folder, output_folder):
+    # 构建输出路径，保持原目录结构
+    root, file = os.path.split(raw_path)
+    relative_path = os.path.relpath(root, source_folder)
+    output_dir = os.path.join(output_folder, relative_path)
+    os.makedirs(output_dir, exist_ok=True)
+    output_path = os.path.join(output_dir, os.path.splitext(file)[0] + '.jpg')
+    return raw_path, output_path
+
+
+def iter_failed_tasks(failed_list_file, source_folder, output_folder):
+    # 只按失败清单重试，不重新遍历目录
+    for raw_path in FailedList.load(failed_list_file):
+        if os.path.exists(raw_path):
+            yield make_task(raw_path, source_folder, output_folder)
+
+
+def decode_raw(source, params, preview=False):
+    # 解码阶段：source 可以是路径或已读入内存的文件对象
+    # 返回 ("jpeg", 字节, 元数据) —— 内嵌JPEG预览，原样写出即可；或 ("rgb", 数组, 元数据) —— 需要编码
+    with rawpy.imread(source) as raw:
+        if preview:
+            thumb = extract_preview(raw)
+            if thumb is not None:
+                kind, data = thumb
+                return kind, data, read_metadata(source, raw, FLIP_TO_ORIENTATION.get(raw.sizes.flip, 1), params)
+            if not preview_fallback:
+                raise ValueError("没有可用的内嵌缩略图")
+            # 预览模式的退路用半尺寸解码：2x2 合一像素，不做插值
+            return "rgb", raw.postprocess(**dict(params, half_size=True)), read_metadata(source, raw, 1, params)
+        return "rgb", raw.postprocess(**params), read_metadata(source, raw, 1, params)
+
+
+def read_metadata(source, raw, orientation, params):
+    # 取RAW的EXIF：TIFF结构的RAW（CR2/NEF/ARW/DNG 等）用 Pillow 只读文件头；
+    # 读不出来时退而取内嵌JPEG预览里的EXIF。返回 {"exif": 字节或None, "icc": 字节或None, "fields": {...}}
+    if not keep_metadata:
+        return None
+    src_exif = None
+    try:
+        if hasattr(source, "seek"):
+            source.seek(0)
+        with Image.open(source) as tif:
+            src_exif = tif.getexif()
+    except Exception:
+        pass
+    if not src_exif:
+        try:
+            thumb = raw.extract_thumb()
+            if thumb.format == rawpy.ThumbFormat.JPEG:
+                src_exif = Image.open(io.BytesIO(thumb.data)).getexif()
+        except (rawpy.LibRawError, OSError):
+            pass
+    exif = Image.Exif()
+    fields = {}
+    if src_exif:
+        # 只挑有用的标签重新组一份：RAW 的 IFD0 里还有条带偏移等像素结构信息，MakerNote 又太大
+        for tag in IFD0_TAGS:
+            if tag in src_exif:
+                exif[tag] = src_exif[tag]
+        for ifd in (EXIF_IFD, GPS_IFD):
+            tags = {k: v for k, v in src_exif.get_ifd(ifd).items() if k != MAKER_NOTE}
+            if tags:
+                exif.get_ifd(ifd).update(tags)
+        for column, (ifd, tag) in INDEX_TAGS.items():
+            value = (src_exif.get_ifd(ifd) if ifd else src_exif).get(tag)
+            if value is not None:
+                fields[column] = index_value(value)
+    exif[0x0112] = orientation
+    fields["orientation"] = orientation
+    # postprocess 默认输出 sRGB，才能放心附上 sRGB 配置文件；改了 output_color 就不附
+    srgb = params.get("output_color", rawpy.ColorSpace.sRGB) == rawpy.ColorSpace.sRGB
+    return {"exif": exif.tobytes(), "icc": srgb_profile() if srgb else None, "fields": fields}
+
+
+def index_value(value):
+    if isinstance(value, str):
+        return value.strip("\x00 ")
+    if isinstance(value, tuple):  # 个别机型的 ISO 等标签是多值
+        value = value[0] if value else ""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return str(value)
+
+
+def srgb_profile():
+    if getattr(_local, "srgb", None) is None:
+        _local.srgb = ImageCms.ImageCmsProfile(ImageCms.createProfile("sRGB")).tobytes()
+    return _local.srgb
+
+
+def extract_preview(raw):
+    # 取相机内嵌的预览图，没有或格式不支持时返回 None
+    try:
+        thumb = raw.extract_thumb()
+    except (rawpy.LibRawNoThumbnailError, rawpy.LibRawUnsupportedThumbnailError):
+        return None
+    if thumb.format == rawpy.ThumbFormat.JPEG:
+        return "jpeg", thumb.data
+    if thumb.format == rawpy.ThumbFormat.BITMAP:
+        return "rgb", thumb.data
+    return None
+
+
+def rendition_path(output_path, rendition):
+    return os.path.splitext(output_path)[0] + rendition["suffix"] + FORMAT_EXTS[rendition["format"]]
+
+
+def encode_write(decoded, output_path, renditions):
+    # 编码写出阶段：按尺寸从大到小依次生成各输出规格，每一级都从上一级缩小而来，
+    # 不必每次从原图重新缩放；原尺寸的JPEG规格遇到内嵌JPEG预览时直接原样落盘（只换上RAW的EXIF段）
+    kind, data, meta = decoded
+    extra = {}
+    if meta:
+        extra["exif"] = meta["exif"]
+    img = None
+    for r in sorted(renditions, key=lambda r: r["max_size"] or float("inf"), reverse=True):
+        path = rendition_path(output_path, r)
+        if kind == "jpeg" and not r["max_size"] and r["format"] == "JPEG":
+            jpeg = jpeg_with_exif(data, meta["exif"]) if meta else data
+            if jpeg is not None:
+                atomic_write(path, lambda f: f.write(jpeg))
+                continue
+        if img is None:
+            img = to_image(data) if kind == "rgb" else Image.open(io.BytesIO(data))
+            # 内嵌JPEG自带的色彩配置优先；像素数组则用解码时确定的配置
+            icc = img.info.get("icc_profile") or (meta and meta["icc"])
+            if icc:
+                extra["icc_profile"] = icc
+        if r["max_size"] and max(img.size) > r["max_size"]:
+            scale = r["max_size"] / max(img.size)
+            size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+            img = img.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+        atomic_write(path, lambda f: img.save(f, r["format"], quality=r["quality"], **extra))
+    if meta:
+        meta["fields"]["width"], meta["fields"]["height"] = (
+            (data.shape[1], data.shape[0]) if kind == "rgb" else Image.open(io.BytesIO(data)).size)
+
+
+def jpeg_with_exif(data, exif):
+    # 把 EXIF 段（APP1）换进JPEG，压缩数据不动，不会因重新编码损失画质；
+    # 原有的 EXIF 段去掉，JFIF 段按规范仍紧跟文件头。结构认不出或 EXIF 超过单段上限时返回 None，由调用方重新编码
+    if data[:2] != b"\xff\xd8" or len(exif) + 2 > 0xFFFF:
+        return None
+    pos = 2
+    jfif, others = [], []
+    while pos + 4 <= len(data) and data[pos] == 0xFF and 0xE0 <= data[pos + 1] <= 0xEF:
+        end = pos + 2 + int.from_bytes(data[pos + 2:pos + 4], "big")
+        segment = data[pos:end]
+        if segment[4:9] == b"JFIF\x00":
+            jfif.append(segment)
+        elif not (data[pos + 1] == 0xE1 and segment[4:10] == b"Exif\x00\x00"):
+            others.append(segment)
+        pos = end
+    if pos > len(data):
+        return None
+    app1 = b"\xff\xe1" + (len(exif) + 2).to_bytes(2, "big") + exif
+    return b"\xff\xd8" + b"".join(jfif) + app1 + b"".join(others) + data[pos:]
+
+
+def atomic_write(path, write):
+    # 先写同目录下的临时文件，写完再改名覆盖：中途崩溃不会留下半截的输出
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def to_image(rgb):
+    # 8位RGB数组直接解码进本线程缓存的同尺寸 PIL 图像，复用其像素缓冲，
+    # 也省去 Image.fromarray 先 tobytes 再建新图的那次拷贝；其他格式照旧走 fromarray
+    if rgb.dtype != 'uint8' or rgb.ndim != 3 or rgb.shape[2] != 3 or not rgb.flags['C_CONTIGUOUS']:
+        return Image.fromarray(rgb)
+    size = (rgb.shape[1], rgb.shape[0])
+    img = getattr(_local, "img", None)
+    if img is None or img.size != size:
+        img = Image.new("RGB", size)
+        _local.img = img
+    img.frombytes(rgb)
+    return img
+
+
+def convert_one(raw_path, output_path, renditions, params, preview=False):
+    # 读取RAW并保存为JPEG（在子进程中执行），返回各工序耗时
+    t0 = time.perf_counter()
+    decoded = decode_raw(raw_path, params, preview)
+    t1 = time.perf_counter()
+    encode_write(decoded, output_path, renditions)
+    return {"decode": t1 - t0, "encode": time.perf_counter() - t1, "meta": decoded[2]}
+
+
+def decode_bytes(data, params, preview=False):
+    # 流水线的解码工序（在子进程中执行），顺带返回耗时供统计
+    t0 = time.perf_counter()
+    decoded = decode_raw(io.BytesIO(data), params, preview)
+    return decoded, time.perf_counter() - t0
+
+
+def file_hash(path, chunk_size=4 * 1024 * 1024):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class Manifest:
+    # 增量清单：记录每个RAW的 路径/大小/mtime/内容哈希/解码参数 与对应输出
+    # 大小+mtime 未变直接跳过（不读文件）；变了才算哈希，哈希能对上旧记录时视为改名，挪用已有JPEG
+    # 改名/复制不改变文件大小：当前参数下没有同样大小的记录时（新拍的照片基本都是），不可能沿用，
+    # 哈希推迟到转换成功后再算，流水线模式下直接用预读线程已读入的字节，不必为算哈希把每个RAW多读一遍。
+    # 清单每隔 save_interval 秒才整体落盘一次；期间崩溃丢掉的记录由断点日志补回（见 Journal）
+    def __init__(self, path, source_folder, params_key, save_interval=30, outputs_of=lambda p: [p], on_reuse=None,
+                 on_unchanged=None, on_error=None):
+        self.path = path
+        self.outputs_of = outputs_of  # 一个源文件对应的全部输出（多规格时不止一个）
+        self.on_reuse = on_reuse      # 改名/复制沿用时通知外部，参数为 (原RAW路径, 新RAW路径)
+        self.on_unchanged = on_unchanged  # 未变化跳过时通知外部，参数为 (RAW路径, 输出路径)
+        self.on_error = on_error      # 读不到源文件时按失败上报，参数同 on_result
+        self.source_folder = source_folder
+        self.params_key = params_key
+        self.save_interval = save_interval
+        self.last_save = time.monotonic()
+        self.entries = {}
+        self.seen = set()
+        self.waiting = {}   # raw_path -> 待转换成功后写入的记录
+        self.dirty = 0
+        self.lock = threading.RLock()  # 流水线模式下扫描与结果回调在不同线程
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f).get("entries", {})
+        except (OSError, ValueError):
+            self.entries = {}
+        self.by_hash = {e["hash"]: rel for rel, e in self.entries.items() if e.get("params") == params_key}
+        self.sizes = {e["size"] for e in self.entries.values() if e.get("params") == params_key}
+
+    def filter(self, tasks):
+        # 只放行需要真正解码的任务，其余当场跳过或通过改名/复制处理
+        for raw_path, output_path in tasks:
+            rel = os.path.relpath(raw_path, self.source_folder)
             try:
-                with rawpy.imread(raw_path) as raw:
-                    rgb = raw.postprocess()
-                    img = Image.fromarray(rgb)
-                    img.save(output_path, 'JPEG', quality=jpeg_quality)
-                print(f"已处理: {raw_path} → {output_path}")
+                st = os.stat(raw_path)
+            except OSError as e:
+                self.fail(raw_path, output_path, e)
+                continue
+            with self.lock:
+                self.seen.add(rel)
+                old = self.entries.get(rel)
+                same_params = bool(old) and old["params"] == self.params_key
+                defer_hash = st.st_size not in self.sizes
+            if (same_params and old["size"] == st.st_size and old["mtime"] == st.st_mtime_ns
+                    and self.outputs_exist(output_path)):
+                if self.on_unchanged is not None:
+                    self.on_unchanged(raw_path, output_path)
+                continue
+            try:
+                digest = None if defer_hash else file_hash(raw_path)
+            except OSError as e:
+                self.fail(raw_path, output_path, e)
+                continue
+            entry = {"size": st.st_size, "mtime": st.st_mtime_ns, "hash": digest,
+                     "params": self.params_key, "output": output_path}
+            with self.lock:
+                try:
+                    reused = digest is not None and self.reuse(rel, old, digest, output_path)
+                except OSError:
+                    reused = False  # 挪用已有输出失败就重新转换
+                if reused:
+                    self.remember(rel, entry)
+                else:
+                    self.waiting[raw_path] = (rel, entry)
+            if reused:
+                print(f"未变化/已改名，沿用: {raw_path} → {output_path}")
+                continue
+            yield raw_path, output_path
+
+    def reuse(self, rel, old, digest, output_path):
+        if old and old["hash"] == digest and old["params"] == self.params_key:
+            return self.outputs_exist(output_path)
+        src_rel = self.by_hash.get(digest)
+        if src_rel is None or src_rel == rel:
+            return False
+        src_output = self.entries[src_rel]["output"]
+        if not self.outputs_exist(src_output):
+            return False
+        source_kept = os.path.exists(os.path.join(self.source_folder, src_rel))
+        for src, dst in zip(self.outputs_of(src_output), self.outputs_of(output_path)):
+            if source_kept:
+                shutil.copyfile(src, dst)  # 复制出的副本
+            else:
+                os.replace(src, dst)       # 源文件改名/移动
+        if not source_kept:
+            del self.entries[src_rel]
+        if self.on_reuse is not None:
+            self.on_reuse(os.path.join(self.source_folder, src_rel), os.path.join(self.source_folder, rel))
+        return True
+
+    def fail(self, raw_path, output_path, error):
+        if self.on_error is not None:
+            self.on_error(raw_path, output_path, error)
+        else:
+            print(f"读取失败: {raw_path}, 错误: {error}")
+
+    def outputs_exist(self, output_path):
+        return all(os.path.exists(p) for p in self.outputs_of(output_path))
+
+    def remember(self, rel, entry):
+        self.entries[rel] = entry
+        self.by_hash[entry["hash"]] = rel
+        self.sizes.add(entry["size"])
+        self.dirty += 1
+        if time.monotonic() - self.last_save >= self.save_interval:
+            self.save()
+
+    def done(self, raw_path, error=None, digest=None):
+        # digest：流水线预读时顺带算好的哈希；没有时才回头读文件
+        with self.lock:
+            rel, entry = self.waiting.pop(raw_path, (None, None))
+        if rel is None or error is not None:
+            return
+        if entry["hash"] is None:
+            try:
+                entry["hash"] = digest or file_hash(raw_path)
+            except OSError:
+                return  # 下次运行再记
+        with self.lock:
+            self.remember(rel, entry)
+
+    def save(self, prune=False):
+        with self.lock:
+            self._save(prune)
+
+    def _save(self, prune):
+        if prune:
+            # 完整扫描结束后，清理已不存在的源文件记录（输出文件保留不删）
+            self.entries = {rel: e for rel, e in self.entries.items() if rel in self.seen}
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"entries": self.entries}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self.dirty = 0
+        self.last_save = time.monotonic()
+
+
+def report(raw_path, output_path, error=None, info=None):
+    if error is None:
+        print(f"已处理: {raw_path} → {output_path}")
+    else:
+        print(f"转换失败: {raw_path}, 错误: {error}")
+
+
+def run_serial(tasks, renditions, params, on_result=report, preview=False):
+    for raw_path, output_path in tasks:
+        try:
+            info = convert_one(raw_path, output_path, renditions, params, preview)
+            on_result(raw_path, output_path, None, info)
+        except Exception as e:
+            on_result(raw_path, output_path, e)
+
+
+def run_pool(tasks, renditions, params, workers, in_flight, on_result=report, preview=False):
+    # 进程池并行转换：在途任务达到上限时先等完成一个，再提交下一个
+    pending = {}
+
+    def collect(done):
+        for fut in done:
+            raw_path, output_path = pending.pop(fut)
+            error = fut.exception()
+            on_result(raw_path, output_path, error, None if error else fut.result())
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for raw_path, output_path in tasks:
+            if len(pending) >= in_flight:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            fut = pool.submit(convert_one, raw_path, output_path, renditions, params, preview)
+            pending[fut] = (raw_path, output_path)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done)
+
+
+class StageStats:
+    # 单个工序的累计统计：件数、字节数、忙碌时间（各线程/进程耗时之和）
+    def __init__(self, name, concurrency):
+        self.name = name
+        self.concurrency = concurrency
+        self.files = 0
+        self.bytes = 0
+        self.busy = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, seconds, nbytes=0):
+        with self.lock:
+            self.files += 1
+            self.bytes += nbytes
+            self.busy += seconds
+
+    def summary(self):
+        per_worker = self.files / self.busy if self.busy else 0.0
+        mb_per_sec = self.bytes / 1024 / 1024 / self.busy * self.concurrency if self.busy else 0.0
+        return (f"{self.name}: {self.files} 个, 累计耗时 {self.busy:.1f}s, "
+                f"单路 {per_worker:.2f} 个/s, {self.concurrency} 路合计约 {per_worker * self.concurrency:.2f} 个/s"
+                + (f", {mb_per_sec:.1f} MB/s" if self.bytes else ""))
+
+
+def run_pipeline(tasks, renditions, params, workers, in_flight, on_result=report, preview=False,
+                 readers=read_threads, encoders=encode_threads, depth=queue_depth):
+    # 三道工序：预读线程 → 解码进程池 → 编码写出线程，工序之间用有界队列连接
+    stats = {
+        "read": StageStats("读取", readers),
+        "decode": StageStats("解码", workers),
+        "encode": StageStats("编码写出", encoders),
+    }
+    read_q = queue.Queue(maxsize=max(depth, 1))
+    encode_q = queue.Queue(maxsize=max(depth, 1))
+    task_iter = iter(tasks)
+    task_lock = threading.Lock()
+    result_lock = threading.Lock()
+    task_errors = []  # 任务迭代器（扫描/清单/断点日志）抛出的异常，等各工序收尾后在主线程重新抛出
+    stop = threading.Event()  # 主循环出错时通知预读线程不再取新任务
+
+    def emit(raw_path, output_path, error=None, info=None):
+        with result_lock:
+            on_result(raw_path, output_path, error, info)
+
+    def reader():
+        # 无论怎样退出都要放结束标记，否则主线程会一直等在 read_q.get()
+        try:
+            while not stop.is_set():
+                with task_lock:
+                    task = next(task_iter, None)
+                if task is None:
+                    break
+                raw_path, output_path = task
+                t0 = time.perf_counter()
+                try:
+                    with open(raw_path, "rb") as f:
+                        data = f.read()
+                except OSError as e:
+                    emit(raw_path, output_path, e)
+                    continue
+                info = {"read": time.perf_counter() - t0, "bytes": len(data)}
+                stats["read"].add(info["read"], len(data))
+                info["sha256"] = hashlib.sha256(data).hexdigest()  # 供增量清单使用，省得再读一遍文件
+                read_q.put((raw_path, output_path, data, info))
+        except BaseException as e:
+            task_errors.append(e)
+        finally:
+            read_q.put(None)
+
+    def encoder():
+        while True:
+            item = encode_q.get()
+            if item is None:
+                break
+            raw_path, output_path, decoded, info = item
+            t0 = time.perf_counter()
+            try:
+                encode_write(decoded, output_path, renditions)
+            except Exception as e:
+                emit(raw_path, output_path, e)
+                continue
+            info["encode"] = time.perf_counter() - t0
+            info["meta"] = decoded[2]
+            stats["encode"].add(info["encode"])
+            emit(raw_path, output_path, None, info)
+
+    pending = {}
+
+    def collect(done):
+        for fut in done:
+            raw_path, output_path, info = pending.pop(fut)
+            try:
+                decoded, info["decode"] = fut.result()
             except Exception as e:
-                print(f"转换失败: {raw_path}, 错误: {e}")
+                emit(raw_path, output_path, e)
+                continue
+            stats["decode"].add(info["decode"])
+            encode_q.put((raw_path, output_path, decoded, info))
+
+    started = time.perf_counter()
+    # 主循环不论怎样退出，都要让预读线程停下、编码线程收到结束标记，否则线程池关不掉、进程一直挂着
+    threads = ThreadPoolExecutor(max_workers=readers + encoders)
+    pool = ProcessPoolExecutor(max_workers=workers)
+    reader_futs = [threads.submit(reader) for _ in range(readers)]
+    encoder_futs = [threads.submit(encoder) for _ in range(encoders)]
+    try:
+        readers_left = readers
+        while readers_left:
+            item = read_q.get()
+            if item is None:
+                readers_left -= 1
+                continue
+            raw_path, output_path, data, info = item
+            while len(pending) >= in_flight:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            try:
+                fut = pool.submit(decode_bytes, data, params, preview)
+            except BrokenProcessPool as e:
+                # 解码子进程崩溃（内存不足被杀、LibRaw 段错误等）：已提交的随之记为失败，
+                # 这一个也记失败，换一个新进程池接着转换后面的文件
+                emit(raw_path, output_path, e)
+                pool.shutdown(wait=False)
+                pool = ProcessPoolExecutor(max_workers=workers)
+                continue
+            pending[fut] = (raw_path, output_path, info)
+            collect([f for f in list(pending) if f.done()])
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done)
+    finally:
+        stop.set()
+        while not all(f.done() for f in reader_futs):
+            try:
+                read_q.get(timeout=0.1)  # 腾出位置，让卡在 put 上的预读线程退出
+            except queue.Empty:
+                pass
+        for _ in range(encoders):
+            encode_q.put(None)
+        threads.shutdown(wait=True)
+        pool.shutdown(wait=True, cancel_futures=True)
+    for fut in encoder_futs:
+        fut.result()
+    if task_errors:
+        raise task_errors[0]
+
+    elapsed = time.perf_counter() - started
+    print(f"流水线总耗时 {elapsed:.1f}s，各工序吞吐：")
+    for stage in stats.values():
+        print("  " + stage.summary())
+    return stats
+
+
+class TimingLog:
+    # 逐文件耗时日志（CSV），每行写完立即落盘，中途中断也能看到已完成部分
+    FIELDS = ["raw_path", "output_path", "status", "bytes", "read_s", "decode_s", "encode_s"]
+
+    def __init__(self, path):
+        self.file = open(path, "w", encoding="utf-8-sig", newline="")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(self.FIELDS)
+
+    def __call__(self, raw_path, output_path, error=None, info=None):
+        info = info or {}
+        self.writer.writerow([
+            raw_path, output_path, "ok" if error is None else f"失败: {error}",
+            info.get("bytes", ""),
+            *(f"{info[k]:.4f}" if k in info else "" for k in ("read", "decode", "encode")),
+        ])
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class Journal:
+    # 断点日志：每转换成功一个就追加一行并落盘；首行记录参数，参数变了旧日志作废
+    # 整批正常结束后删除，下次从头（配合增量清单仍会跳过未变化的文件）
+    def __init__(self, path, params_key):
+        self.path = path
+        self.done_paths = set()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                lines = f.read().split("\n")
+            # 最后一段没有换行结尾，说明是崩溃时写了一半的行，丢弃
+            if lines and lines[0] == params_key:
+                self.done_paths = set(line for line in lines[1:-1] if line)
+        except OSError:
+            pass
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        fresh = not self.done_paths
+        self.file = open(path, "w" if fresh else "a", encoding="utf-8")
+        if fresh:
+            self.file.write(params_key + "\n")
+            self.file.flush()
+        self.lock = threading.Lock()
+
+    def filter(self, tasks, on_skip=None):
+        skipped = 0
+        for raw_path, output_path in tasks:
+            if raw_path in self.done_paths:
+                skipped += 1
+                if on_skip is not None:
+                    on_skip(raw_path, output_path)
+                continue
+            yield raw_path, output_path
+        if skipped:
+            print(f"从断点继续：跳过上次已完成的 {skipped} 个文件")
+
+    def __call__(self, raw_path, output_path, error=None, info=None):
+        if error is not None:
+            return
+        with self.lock:
+            self.file.write(raw_path + "\n")
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def finish(self):
+        self.file.close()
+        os.remove(self.path)
+
+
+class FailedList:
+    # 失败清单：一行一个 "RAW路径<Tab>错误信息"，可单独拿来重试
+    def __init__(self):
+        self.failed = []
+
+    def __call__(self, raw_path, output_path, error=None, info=None):
+        if error is not None:
+            self.failed.append((raw_path, str(error).replace("\n", " ")))
+
+    def save(self, path):
+        if not self.failed:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        atomic_write(path, lambda f: f.write("".join(f"{p}\t{e}\n" for p, e in self.failed).encode("utf-8")))
+        print(f"有 {len(self.failed)} 个文件转换失败，清单见：{path}")
+
+    @staticmethod
+    def load(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return [line.split("\t", 1)[0] for line in f if line.strip()]
+        except OSError:
+            return []
+
+
+class SidecarIndex:
+    # 索引表（CSV）：一行一张图，包括拍摄信息和全部输出路径，下游检索不必再打开RAW
+    # 启动时读入旧表，本次转换的行覆盖更新；每隔 save_interval 秒落盘一次，结束时整体写回并删掉源文件已不存在的行。
+    # 上次中途崩溃、被断点日志或增量清单跳过的文件若缺行，由 backfill 从RAW和已有输出补上
+    FIELDS = ["raw_path", "outputs", *INDEX_TAGS, "orientation", "width", "height"]
+
+    def __init__(self, path, outputs_of, source_folder, output_folder, params, preview=False, save_interval=30):
+        self.path = path
+        self.outputs_of = outputs_of
+        self.source_folder = source_folder
+        self.output_folder = output_folder
+        self.params = params
+        self.preview = preview
+        self.save_interval = save_interval
+        self.last_save = time.monotonic()
+        self.rows = {}
+        self.lock = threading.Lock()
+        try:
+            with open(path, "r", encoding="utf-8-sig", newline="") as f:
+                self.rows = {row["raw_path"]: row for row in csv.DictReader(f)}
+        except OSError:
+            pass
+
+    def __call__(self, raw_path, output_path, error=None, info=None):
+        meta = (info or {}).get("meta")
+        if error is not None or not meta:
+            return
+        self.put(raw_path, dict(meta["fields"], raw_path=raw_path, outputs=";".join(self.outputs_of(output_path))))
+
+    def put(self, raw_path, row):
+        with self.lock:
+            self.rows[raw_path] = row
+            if time.monotonic() - self.last_save >= self.save_interval:
+                self._save(prune=False)
+
+    def move(self, old_raw_path, new_raw_path):
+        # 增量清单发现改名/复制时，沿用旧行并改成新路径
+        with self.lock:
+            row = self.rows.get(old_raw_path)
+        if row is not None:
+            _, output_path = make_task(new_raw_path, self.source_folder, self.output_folder)
+            self.put(new_raw_path, dict(row, raw_path=new_raw_path, outputs=";".join(self.outputs_of(output_path))))
+
+    def backfill(self, raw_path, output_path):
+        # 跳过的文件已有输出但表里没有行时补上：RAW只读文件头取EXIF，宽高取自已有输出，不解码
+        with self.lock:
+            if raw_path in self.rows:
+                return
+        outputs = self.outputs_of(output_path)
+        try:
+            with rawpy.imread(raw_path) as raw:
+                orientation = FLIP_TO_ORIENTATION.get(raw.sizes.flip, 1) if self.preview else 1
+                meta = read_metadata(raw_path, raw, orientation, self.params)
+            sizes = []
+            for path in outputs:
+                with Image.open(path) as img:
+                    sizes.append(img.size)
+            meta["fields"]["width"], meta["fields"]["height"] = max(sizes, key=lambda wh: wh[0] * wh[1])
+        except (rawpy.LibRawError, OSError) as e:
+            print(f"索引补行失败: {raw_path}, 错误: {e}")
+            return
+        self.put(raw_path, dict(meta["fields"], raw_path=raw_path, outputs=";".join(outputs)))
+
+    def save(self):
+        with self.lock:
+            self._save(prune=True)
+
+    def _save(self, prune):
+        # 中途落盘不做 prune，省得每次都逐个检查源文件是否还在
+        rows = [row for path, row in sorted(self.rows.items()) if not prune or os.path.exists(path)]
+        self.last_save = time.monotonic()
+        buf = io.StringIO()
+        writer = csv.DictWriter(buf, fieldnames=self.FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+        data = buf.getvalue().encode("utf-8-sig")
+        atomic_write(self.path, lambda f: f.write(data))
+
+
+def estimate_file_bytes(raw_path):
+    # 只读RAW头信息取像素数，不解码
+    with rawpy.imread(raw_path) as raw:
+        pixels = raw.sizes.raw_width * raw.sizes.raw_height
+    return pixels * BYTES_PER_PIXEL + os.path.getsize(raw_path)
+
+
+def plan_memory(tasks, budget_mb, workers, pipeline=True):
+    # 按内存上限算出能同时在途的文件数，返回 (任务迭代器, 进程数, 在途上限, 队列长度, 编码线程数)
+    # 流水线模式下主进程里也压着解码结果：编码队列 1 个、等着放进队列的 1 个、每个编码线程各 1 个，
+    # 这些先从上限里扣掉，剩下的才给解码进程；进程池模式解码编码都在子进程里，不用扣
+    # 读不出头信息的文件换下一个来估算，它们照样留在任务里，转换时记进失败清单
+    tasks = iter(tasks)
+    probed = []
+    per_file = None
+    for task in tasks:
+        probed.append(task)
+        try:
+            per_file = estimate_file_bytes(task[0])
+            break
+        except (rawpy.LibRawError, OSError) as e:
+            print(f"无法读取RAW头信息，换下一个文件估算内存: {task[0]}, 错误: {e}")
+    tasks = itertools.chain(probed, tasks)
+    if per_file is None:
+        return tasks, workers, workers, queue_depth, encode_threads
+    slots = max(1, int(budget_mb * 1024 * 1024 // per_file))
+    depth = 1
+    if pipeline:
+        held = depth + 1  # 编码队列 + 主线程手上等着放进队列的
+        workers = max(1, min(workers, slots - held - 1))
+        encoders = max(1, min(encode_threads, slots - held - workers))
+        used = workers + held + encoders
+    else:
+        workers = max(1, min(workers, slots))
+        encoders = encode_threads
+        used = workers
+    print(f"内存上限 {budget_mb} MB，单个文件约 {per_file / 1024 / 1024:.0f} MB，"
+          f"同时在途 {slots} 个，解码进程 {workers} 个" + (f"，编码线程 {encoders} 个" if pipeline else ""))
+    if used > slots:
+        print(f"  注意：内存上限不够最少的 {used} 个文件同时在途，实际占用会超出上限")
+    return tasks, workers, workers, depth, encoders
+
+
+if __name__ == "__main__":
+    if retry_failed_only:
+        tasks = iter_failed_tasks(failed_list_file, source_folder, output_folder)
+    else:
+        tasks = iter_raw_tasks(source_folder, output_folder, scan_threads, dir_cache_file)
+    params_key = json.dumps({"renditions": renditions, "postprocess": postprocess_params,
+                             "preview": preview_mode, "metadata": keep_metadata}, sort_keys=True, default=str)
+    outputs_of = lambda p: [rendition_path(p, r) for r in renditions]
+    listeners = [report]
+    index = (SidecarIndex(index_file, outputs_of, source_folder, output_folder, postprocess_params, preview_mode)
+             if index_file and keep_metadata else None)
+    if index is not None:
+        listeners.append(index)
+    manifest = None
+    if incremental:
+        manifest = Manifest(manifest_file, source_folder, params_key, outputs_of=outputs_of,
+                            on_reuse=index.move if index is not None else None,
+                            on_unchanged=index.backfill if index is not None else None,
+                            on_error=lambda *args: on_result(*args))
+        tasks = manifest.filter(tasks)
+        listeners.append(lambda raw_path, output_path, error=None, info=None:
+                         manifest.done(raw_path, error, (info or {}).get("sha256")))
+    journal = Journal(journal_file, params_key)
+
+    # 断点跳过的文件上次已转换成功，照样记进增量清单；索引表缺行的顺带补上
+    def on_skip(raw_path, output_path):
+        if manifest is not None:
+            manifest.done(raw_path)
+        if index is not None:
+            index.backfill(raw_path, output_path)
+
+    tasks = journal.filter(tasks, on_skip=on_skip)
+    failed = FailedList()
+    listeners += [journal, failed]
+    timing_log = TimingLog(timing_log_file) if timing_log_file else None
+    if timing_log is not None:
+        listeners.append(timing_log)
+
+    result_lock = threading.Lock()
+
+    def on_result(raw_path, output_path, error=None, info=None):
+        # 流水线模式下结果回调和任务迭代器（清单报错）在不同线程
+        with result_lock:
+            for listener in listeners:
+                listener(raw_path, output_path, error, info)
+
+    workers, in_flight = worker_count, max(max_in_flight, worker_count)
+    depth, encoders = queue_depth, encode_threads
+    if memory_budget_mb > 0 and not preview_mode:
+        tasks, workers, in_flight, depth, encoders = plan_memory(tasks, memory_budget_mb, worker_count,
+                                                                 pipeline=worker_count > 1 and engine == "pipeline")
+
+    if workers > 1 and engine == "pipeline":
+        run_pipeline(tasks, renditions, postprocess_params, workers, in_flight, on_result,
+                     preview_mode, encoders=encoders, depth=depth)
+    elif workers > 1:
+        run_pool(tasks, renditions, postprocess_params, workers, in_flight, on_result, preview_mode)
+    else:
+        run_serial(tasks, renditions, postprocess_params, on_result, preview_mode)
+
+    if manifest is not None:
+        manifest.save(prune=not retry_failed_only)
+    journal.finish()
+    if index is not None:
+        index.save()
+    failed.save(failed_list_file)
+    if timing_log is not None:
+        timing_log.close()
 
-print("批量转换完成！")
+    print("批量转换完成！")